@@ -1,17 +1,379 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, g, Response, stream_with_context, has_app_context, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
 from flask_migrate import Migrate
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, check_password_hash
+from markupsafe import Markup
+from jinja2 import FileSystemBytecodeCache, Template, nodes
+from jinja2.ext import Extension
 from datetime import datetime, date, timedelta
+import os
+from sqlalchemy import DDL, and_, bindparam, case, column, delete, event, exists, func, insert, literal, null, or_, select, table, text, true, tuple_, union, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import joinedload
+import atexit
+import csv
+import functools
+import hashlib
+import heapq
+import io
+import json
+import logging
+import re
+from collections import OrderedDict
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from types import SimpleNamespace
+from urllib.parse import urlencode
+import zlib
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///re-bytebank.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///re-bytebank.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = 'replace-this-with-a-secure-random-key'
-db = SQLAlchemy(app)
+app.config['ROLLOVER_CHUNK_SIZE'] = 500  # users per set-based rollover chunk
+app.config['EXPIRY_SCHEDULER_ENABLED'] = True
+app.config['EXPIRY_PURGE_CHUNK_SIZE'] = 1000  # rows per bulk DELETE
+app.config['EXPIRY_POLL_SECONDS'] = 30  # max sleep between purge passes
+app.config['EXPIRY_RELOAD_SECONDS'] = 300  # re-read the index to pick up other workers' writes
+app.config['TRANSACTIONS_PAGE_SIZE'] = 50
+app.config['EXPORT_BATCH_SIZE'] = 1000  # rows fetched per query while streaming exports
+app.config['BATCH_TRANSFER_MAX_ITEMS'] = 5000
+app.config['MAX_AMOUNT_MB'] = 10 ** 9  # largest single debit/transfer/purchase; keeps SQL integers in range
+app.config['API_MAX_PAGE_SIZE'] = 200
+app.config['JOB_WORKERS'] = 2  # background admin jobs run on this many threads
+app.config['JOB_STALE_SECONDS'] = 600  # a running job without progress for this long is presumed dead
+app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'WARNING')  # DEBUG turns on per-request event logs
+app.config['LOG_FORMAT'] = os.environ.get('LOG_FORMAT', 'json')  # json or text
+app.config['METRICS_ENABLED'] = True  # /metrics in Prometheus text format
+app.config['SLOW_QUERY_SECONDS'] = 0.25  # statements at least this slow are logged and counted
+app.config['ADMIN_USERS_PAGE_SIZE'] = 50
+app.config['MARKETPLACE_PAGE_SIZE'] = 24
+app.config['MARKETPLACE_CACHE_MAX_ENTRIES'] = 512
+app.config['MARKETPLACE_CACHE_MAX_BYTES'] = 8 * 1024 * 1024  # approximate; text length of cached pages
+app.config['MARKETPLACE_CACHE_TTL'] = 30  # seconds; bounds staleness across worker processes
+app.config['JINJA_BYTECODE_CACHE_DIR'] = os.environ.get('JINJA_BYTECODE_CACHE_DIR', os.path.join(app.instance_path, 'jinja_cache'))
+app.config['FRAGMENT_CACHE_MAX_ENTRIES'] = 1024
+app.config['FRAGMENT_CACHE_MAX_BYTES'] = 16 * 1024 * 1024
+app.config['FRAGMENT_CACHE_TTL'] = 60  # seconds; also bounds staleness of data outside the key
+app.config['CONDITIONAL_GET_ENABLED'] = True  # ETag/304 on per-user pages (needs the SQLite data_version triggers)
+app.config['ETAG_SALT'] = os.environ.get('ETAG_SALT', str(int(os.path.getmtime(__file__))))  # change per release
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:260000')  # werkzeug method[:iterations]
+app.config['PASSWORD_HASH_WORKERS'] = 4  # concurrent hashes per process
+app.config['PASSWORD_HASH_MAX_QUEUE'] = 16  # waiting hashes before requests are turned away
+app.config['PASSWORD_HASH_TIMEOUT'] = 10  # seconds
+app.config['ACTIVITY_FLUSH_ENABLED'] = True  # background flush thread; off means flush at exit only
+app.config['ACTIVITY_FLUSH_SECONDS'] = 10
+app.config['ACTIVITY_MAX_PENDING'] = 5000  # users buffered before an early flush
+
+# SQLite engine profiles: PRAGMAs applied on every new connection plus pool sizing.
+# 'legacy' is SQLite's own defaults (rollback journal, full sync, no busy wait).
+SQLITE_PROFILES = {
+    'legacy': {'pragmas': {}, 'pool_size': 5, 'max_overflow': 10},
+    'wal': {
+        'pragmas': {
+            'journal_mode': 'WAL',        # readers no longer block the writer (or vice versa)
+            'synchronous': 'NORMAL',      # fsync at checkpoints only; safe in WAL mode
+            'cache_size': -64000,         # 64 MB page cache per connection
+            'mmap_size': 268435456,       # 256 MB memory-mapped reads
+            'busy_timeout': 5000,         # wait for the write lock instead of failing
+            'temp_store': 'MEMORY',
+        },
+        # Many readers in parallel, but SQLite has one writer at a time anyway
+        'pool_size': 10, 'max_overflow': 10,
+    },
+    'wal_durable': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'FULL',
+            'cache_size': -64000,
+            'mmap_size': 268435456,
+            'busy_timeout': 5000,
+            'temp_store': 'MEMORY',
+        },
+        'pool_size': 10, 'max_overflow': 10,
+    },
+}
+app.config['SQLITE_PROFILE'] = os.environ.get('SQLITE_PROFILE', 'wal')
+
+def sqlite_engine_options(uri, profile_name):
+    """Pool settings for the profile; in-memory databases keep SQLAlchemy's own pool."""
+    if not uri.startswith('sqlite') or uri.rstrip('/') in ('sqlite:', 'sqlite://') or ':memory:' in uri:
+        return {}
+    profile = SQLITE_PROFILES[profile_name]
+    return {
+        'pool_size': profile['pool_size'],
+        'max_overflow': profile['max_overflow'],
+        'pool_timeout': 30,
+        'pool_pre_ping': False,
+    }
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = sqlite_engine_options(
+    app.config['SQLALCHEMY_DATABASE_URI'], app.config['SQLITE_PROFILE']
+)
+
+def sqlite_read_only_uri(uri):
+    """mode=ro URI for the same SQLite file, or None when the primary isn't a plain file path."""
+    url = make_url(uri)
+    if not url.drivername.startswith('sqlite') or url.database in (None, '', ':memory:') or url.query.get('uri'):
+        return None
+    return url.set(database=f"file:{url.database}", query={'mode': 'ro', 'uri': 'true'}).render_as_string()
+
+# Read-only request handling goes to its own pool: an explicit replica, or a
+# mode=ro connection to the same SQLite file (WAL lets it read while we write).
+app.config['READ_DATABASE_URI'] = os.environ.get('READ_REPLICA_URL') or sqlite_read_only_uri(
+    app.config['SQLALCHEMY_DATABASE_URI']
+)
+if app.config['READ_DATABASE_URI']:
+    app.config['SQLALCHEMY_BINDS'] = {
+        'read': dict(
+            sqlite_engine_options(app.config['READ_DATABASE_URI'], app.config['SQLITE_PROFILE']),
+            url=app.config['READ_DATABASE_URI'],
+        ),
+    }
+
+class RoutingSession(FlaskSQLAlchemySession):
+    """Sends everything to the 'read' engine while a read_only view is running."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context() and g.get('read_only'):
+            engine = self._db.engines.get('read')
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 migrate = Migrate(app,db)
 
+def sqlite_pragma_listener(skip=()):
+    pragmas = {
+        name: value
+        for name, value in SQLITE_PROFILES[app.config['SQLITE_PROFILE']]['pragmas'].items()
+        if name not in skip
+    }
+
+    def apply_sqlite_pragmas(dbapi_conn, connection_record):
+        if not pragmas:
+            return
+        cursor = dbapi_conn.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+    return apply_sqlite_pragmas
+
+# Logging: one JSON object (or text line) per event on the 'bytebank' logger
+logger = logging.getLogger('bytebank')
+
+class JSONLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'event': record.getMessage(),
+            **getattr(record, 'fields', {}),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TextLogFormatter(logging.Formatter):
+    def format(self, record):
+        fields = ' '.join(f'{k}={v}' for k, v in getattr(record, 'fields', {}).items())
+        line = f"{record.levelname} {record.getMessage()} {fields}".rstrip()
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+if not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(JSONLogFormatter() if app.config['LOG_FORMAT'] == 'json' else TextLogFormatter())
+    logger.addHandler(_log_handler)
+    logger.propagate = False
+logger.setLevel(app.config['LOG_LEVEL'])
+
+def log_event(level, event, **fields):
+    """Structured log line; costs one level check when the level is disabled."""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={'fields': fields})
+
+class Metrics:
+    """Minimal in-process counters and histograms, rendered in the Prometheus
+    text exposition format. Label values are passed as keyword arguments."""
+
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}  # name -> (type, help, buckets)
+        self._values = {}  # name -> {labels: value or [bucket counts..., sum, count]}
+        self._collectors = []
+
+    def counter(self, name, help):
+        self._meta[name] = ('counter', help, None)
+        self._values[name] = {}
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        self._meta[name] = ('histogram', help, buckets)
+        self._values[name] = {}
+
+    def collector(self, fn):
+        """Register fn() -> [(name, type, help, [(labels dict, value), ...])], read at scrape time."""
+        self._collectors.append(fn)
+        return fn
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values[name]
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        buckets = self._meta[name][2]
+        with self._lock:
+            series = self._values[name].get(key)
+            if series is None:
+                series = self._values[name][key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @staticmethod
+    def _labels(pairs):
+        if not pairs:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+    def render(self):
+        lines = []
+        with self._lock:
+            snapshot = {name: dict(series) for name, series in self._values.items()}
+            snapshot = {name: {k: list(v) if isinstance(v, list) else v for k, v in series.items()}
+                        for name, series in snapshot.items()}
+        for name, (kind, help, buckets) in self._meta.items():
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(snapshot[name].items()):
+                if kind == 'counter':
+                    lines.append(f'{name}{self._labels(labels)} {value}')
+                    continue
+                for bound, count in zip(buckets, value):
+                    lines.append(f'{name}_bucket{self._labels(labels + (("le", f"{bound:g}"),))} {count}')
+                lines.append(f'{name}_bucket{self._labels(labels + (("le", "+Inf"),))} {value[-1]}')
+                lines.append(f'{name}_sum{self._labels(labels)} {value[-2]:.6f}')
+                lines.append(f'{name}_count{self._labels(labels)} {value[-1]}')
+        for collect in self._collectors:
+            for name, kind, help, samples in collect():
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{self._labels(tuple(sorted(labels.items())))} {value}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+metrics.counter('bytebank_http_requests_total', 'HTTP requests by endpoint, method and status.')
+metrics.histogram('bytebank_http_request_duration_seconds', 'Time to produce the response, by endpoint.')
+metrics.histogram('bytebank_db_statements_per_request', 'SQL statements executed per request.',
+                  buckets=Metrics.COUNT_BUCKETS)
+metrics.counter('bytebank_db_statements_total', 'SQL statements executed, by endpoint (background for workers).')
+metrics.counter('bytebank_db_statement_seconds_total', 'Time spent executing SQL, by endpoint.')
+metrics.counter('bytebank_db_slow_statements_total', 'Statements slower than SLOW_QUERY_SECONDS.')
+metrics.counter('bytebank_db_commits_total', 'Database commits, by engine bind and endpoint.')
+
+def metrics_endpoint():
+    if has_request_context():
+        return request.endpoint or 'unmatched'
+    return 'background'
+
+def sql_metrics_listeners(bind):
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info['query_started'].pop()
+        endpoint = metrics_endpoint()
+        if has_request_context():
+            g.sql_statements = g.get('sql_statements', 0) + 1
+            g.sql_seconds = g.get('sql_seconds', 0.0) + seconds
+        else:
+            metrics.inc('bytebank_db_statements_total', endpoint=endpoint)
+            metrics.inc('bytebank_db_statement_seconds_total', seconds, endpoint=endpoint)
+        if seconds >= app.config['SLOW_QUERY_SECONDS']:
+            metrics.inc('bytebank_db_slow_statements_total', endpoint=endpoint)
+            log_event(logging.WARNING, 'slow_query', endpoint=endpoint, bind=bind,
+                      ms=round(seconds * 1000, 1), statement=statement[:500])
+
+    def handle_error(exception_context):
+        started = exception_context.connection.info.get('query_started') if exception_context.connection else None
+        if started:
+            started.pop()
+
+    def commit(conn):
+        metrics.inc('bytebank_db_commits_total', bind=bind, endpoint=metrics_endpoint())
+
+    return {'before_cursor_execute': before_cursor_execute, 'after_cursor_execute': after_cursor_execute,
+            'handle_error': handle_error, 'commit': commit}
+
+with app.app_context():
+    for bind_key, engine in db.engines.items():
+        if engine.dialect.name == 'sqlite':
+            # a read-only connection can't switch the journal mode
+            skip = ('journal_mode',) if bind_key == 'read' else ()
+            event.listen(engine, 'connect', sqlite_pragma_listener(skip))
+        for name, listener in sql_metrics_listeners(bind_key or 'primary').items():
+            event.listen(engine, name, listener)
+
+def read_only(view):
+    """Run the view on the read-only connection pool. Any write inside it fails."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.read_only = True
+        return view(*args, **kwargs)
+    return wrapper
+
+def conditional_get(view=None, *, flashes=True):
+    """Answer If-None-Match with 304 before the view runs its queries.
+
+    The ETag covers the user's data_version (bumped by triggers on every wallet,
+    lot, transaction and usage change, and when a counterparty changes email),
+    session_version (profile edits), last_login, today's date (daily quota
+    rollover) and the URL. Pending flash messages always get a full render,
+    unless the view never shows them (flashes=False).
+    """
+    if view is None:
+        return functools.partial(conditional_get, flashes=flashes)
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        user_id = session.get('user_id')
+        if (not user_id or (flashes and session.get('_flashes')) or not app.config['CONDITIONAL_GET_ENABLED']
+                or db.engine.dialect.name != 'sqlite'):
+            return view(*args, **kwargs)
+        versions = db.session.execute(
+            select(User.data_version, User.session_version, User.last_login).where(User.id == user_id)
+        ).first()
+        if versions is None:
+            return view(*args, **kwargs)
+        etag = hashlib.sha1(
+            f"{app.config['ETAG_SALT']}|{request.full_path}|{user_id}|{'|'.join(map(str, versions))}|{date.today()}".encode()
+        ).hexdigest()
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return wrapper
+
 # Models
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -25,6 +387,10 @@ class User(db.Model):
     is_admin = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_login = db.Column(db.DateTime)
+    last_seen_at = db.Column(db.DateTime)  # written behind by activity_buffer
+    page_views = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # bumped by DATA_VERSION_DDL triggers
+    session_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # bumped when cached identity goes stale
     
 
     wallet = db.relationship('DataWallet', uselist=False, back_populates='user')
@@ -32,10 +398,10 @@ class User(db.Model):
     received_transactions = db.relationship('Transaction', back_populates='receiver', foreign_keys='Transaction.receiver_id')
 
     def set_password(self, raw):
-        self.password_hash = generate_password_hash(raw)
+        self.password_hash = password_service.hash(raw)
 
     def check_password(self, raw):
-        return check_password_hash(self.password_hash, raw)
+        return password_service.verify(self.password_hash, raw)
 
 class DataItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -45,6 +411,28 @@ class DataItem(db.Model):
     seller_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     seller = db.relationship('User', backref='data_items')
 
+    __table_args__ = (
+        db.Index('ix_data_item_price', 'price'),
+    )
+
+# Full-text index over listings: an external-content FTS5 table that stores
+# only the index, kept in step with data_item by triggers (SQLite only).
+DATA_ITEM_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS data_item_fts USING fts5("
+    "title, description, content='data_item', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS data_item_fts_ai AFTER INSERT ON data_item BEGIN "
+    "INSERT INTO data_item_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS data_item_fts_ad AFTER DELETE ON data_item BEGIN "
+    "INSERT INTO data_item_fts(data_item_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS data_item_fts_au AFTER UPDATE OF title, description ON data_item BEGIN "
+    "INSERT INTO data_item_fts(data_item_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); "
+    "INSERT INTO data_item_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+]
+for ddl in DATA_ITEM_FTS_DDL:
+    event.listen(DataItem.__table__, 'after_create', DDL(ddl).execute_if(dialect='sqlite'))
+
+data_item_fts = table('data_item_fts', column('rowid'), column('data_item_fts'))
+
 class DataWallet(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), unique=True, nullable=False)
@@ -52,6 +440,7 @@ class DataWallet(db.Model):
     total_purchased_mb = db.Column(db.Integer,default=0)
     total_used_mb = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # drives incremental reconciliation
 
     user = db.relationship('User', back_populates='wallet')
 
@@ -66,6 +455,12 @@ class Transaction(db.Model):
     sender = db.relationship('User', back_populates='sent_transactions', foreign_keys=[sender_id])
     receiver = db.relationship('User', back_populates='received_transactions', foreign_keys=[receiver_id])
 
+    __table_args__ = (
+        db.Index('ix_transaction_sender_id_timestamp', 'sender_id', 'timestamp'),
+        db.Index('ix_transaction_receiver_id_timestamp', 'receiver_id', 'timestamp'),
+        db.Index('ix_transaction_timestamp', 'timestamp'),
+    )
+
 class DataEntry(db.Model):
     _tablename_ = 'data_entry'
     
@@ -78,18 +473,206 @@ class DataEntry(db.Model):
 
     user = db.relationship('User', backref='data_entries')
 
+    __table_args__ = (
+        db.Index('ix_data_entry_user_id_expiry_date', 'user_id', 'expiry_date', 'amount_mb'),
+        db.Index('ix_data_entry_expiry_date', 'expiry_date'),
+        db.Index('ix_data_entry_added_on', 'added_on', 'user_id'),  # incremental reconciliation
+    )
+
     @property
     def is_active(self):
         """Check if entry is still valid."""
         return self.expiry_date >= datetime.utcnow()
 
+class Job(db.Model):
+    """A long admin operation run by job_runner; the row is its persisted state."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed, cancelled
+    params = db.Column(db.JSON)
+    result = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    progress_done = db.Column(db.Integer, nullable=False, default=0)
+    progress_total = db.Column(db.Integer)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # At most one queued or running job per kind, across all workers
+        db.Index('ix_job_active_kind', 'kind', unique=True,
+                 sqlite_where=text("status IN ('queued', 'running')"),
+                 postgresql_where=text("status IN ('queued', 'running')")),
+        db.Index('ix_job_created_at', 'created_at'),
+    )
+
+# Triggers that bump user.data_version whenever something shown on the user's
+# own pages changes, however it is written (routes, bulk jobs, scripts).
+def _bump_data_version(user_ids):
+    return f"UPDATE user SET data_version = data_version + 1 WHERE id IN ({user_ids});"
+
+COUNTERPARTY_IDS = ('SELECT receiver_id FROM "transaction" WHERE sender_id = new.id '
+                    'UNION SELECT sender_id FROM "transaction" WHERE receiver_id = new.id')
+
+DATA_VERSION_DDL = {
+    'user': [
+        "CREATE TRIGGER IF NOT EXISTS user_data_version_au AFTER UPDATE OF "
+        "daily_quota_mb, used_today_mb, total_used_mb, last_usage_date ON user BEGIN "
+        + _bump_data_version('new.id') + " END",
+        # Transaction history shows counterparty emails
+        "CREATE TRIGGER IF NOT EXISTS user_counterparty_data_version_au AFTER UPDATE OF email ON user "
+        "WHEN old.email IS NOT new.email BEGIN "
+        + _bump_data_version(COUNTERPARTY_IDS) + " END",
+    ],
+    'data_wallet': [
+        f"CREATE TRIGGER IF NOT EXISTS data_wallet_data_version_a{op[0].lower()} AFTER {op} ON data_wallet BEGIN "
+        + _bump_data_version(f"{row}.user_id") + " END"
+        for op, row in (('INSERT', 'new'), ('UPDATE', 'new'), ('DELETE', 'old'))
+    ],
+    'data_entry': [
+        f"CREATE TRIGGER IF NOT EXISTS data_entry_data_version_a{op[0].lower()} AFTER {op} ON data_entry BEGIN "
+        + _bump_data_version(f"{row}.user_id") + " END"
+        for op, row in (('INSERT', 'new'), ('UPDATE', 'new'), ('DELETE', 'old'))
+    ],
+    'transaction': [
+        f"CREATE TRIGGER IF NOT EXISTS transaction_data_version_a{op[0].lower()} AFTER {op} ON \"transaction\" BEGIN "
+        + _bump_data_version(f"{row}.sender_id, {row}.receiver_id") + " END"
+        for op, row in (('INSERT', 'new'), ('DELETE', 'old'))
+    ],
+}
+for table_name, statements in DATA_VERSION_DDL.items():
+    for ddl in statements:
+        event.listen(db.metadata.tables[table_name], 'after_create', DDL(ddl).execute_if(dialect='sqlite'))
+
 # Helpers
+class Identity:
+    """Header-level view of the logged-in user, cached in the signed session cookie."""
+    __slots__ = ('id', 'name', 'is_admin', 'version')
+
+    def __init__(self, id, name, is_admin, version):
+        self.id = id
+        self.name = name
+        self.is_admin = is_admin
+        self.version = version
+
+class PasswordServiceBusy(RuntimeError):
+    """Raised when too many password hashes are already queued or one timed out."""
+
+class PasswordService:
+    """Runs password hashing on a small bounded thread pool.
+
+    pbkdf2 releases the GIL, so hashes run in parallel with request threads,
+    while the pool size caps how much CPU a login burst can take. At most
+    PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE hashes are in flight;
+    beyond that callers get PasswordServiceBusy right away instead of piling up.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._executor = None
+        self._slots = None
+        self._init_lock = threading.Lock()
+
+    @property
+    def method(self):
+        return self.app.config['PASSWORD_HASH_METHOD']
+
+    def _run(self, fn, *args):
+        with self._init_lock:
+            if self._executor is None:
+                workers = self.app.config['PASSWORD_HASH_WORKERS']
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+                self._slots = threading.BoundedSemaphore(workers + self.app.config['PASSWORD_HASH_MAX_QUEUE'])
+        if not self._slots.acquire(blocking=False):
+            raise PasswordServiceBusy()
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.app.config['PASSWORD_HASH_TIMEOUT'])
+        except FutureTimeoutError:
+            raise PasswordServiceBusy() from None
+
+    def hash(self, raw):
+        return self._run(generate_password_hash, raw, self.method)
+
+    def verify(self, stored_hash, raw):
+        if not stored_hash:
+            return False
+        return self._run(check_password_hash, stored_hash, raw)
+
+    @property
+    def method_prefix(self):
+        """The configured method as Werkzeug writes it into a hash: pbkdf2 always
+        records its iteration count, filled in with the default when omitted."""
+        method = self.method
+        if method.startswith('pbkdf2:') and method.count(':') == 1:
+            method = f'{method}:{DEFAULT_PBKDF2_ITERATIONS}'
+        return method
+
+    def needs_rehash(self, stored_hash):
+        """True when the hash was made with a different method or cost than configured."""
+        return stored_hash.split('$', 1)[0] != self.method_prefix
+
+password_service = PasswordService(app)
+
+def remember_identity(user):
+    session['identity'] = {
+        'id': user.id,
+        'name': user.name,
+        'is_admin': bool(user.is_admin),
+        'version': user.session_version or 0,
+    }
+
+def forget_identity():
+    session.pop('user_id', None)
+    session.pop('identity', None)
+    g.pop('current_user', None)
+
+def bump_identity(user):
+    """Mark cached identities of this user stale (call before committing a
+    profile or password change) and refresh the one in this session."""
+    user.session_version = (user.session_version or 0) + 1
+    remember_identity(user)
+
 def current_user():
-    """Return the logged-in User object or None."""
+    """Return the logged-in User object (wallet included) or None.
+    Loaded at most once per request."""
+    if 'current_user' in g:
+        return g.current_user
+    user = None
+    user_id = session.get('user_id')
+    if user_id:
+        user = db.session.execute(
+            select(User).options(joinedload(User.wallet)).where(User.id == user_id)
+        ).scalar()
+        if user is None:
+            forget_identity()
+        else:
+            snapshot = session.get('identity') or {}
+            if snapshot.get('id') != user.id or snapshot.get('version') != (user.session_version or 0):
+                remember_identity(user)
+    g.current_user = user
+    return user
+
+def current_identity():
+    """Return the session's Identity without touching the database when the
+    snapshot is present; falls back to current_user() to build it."""
     user_id = session.get('user_id')
     if not user_id:
         return None
-    return User.query.get(user_id)
+    snapshot = session.get('identity')
+    if not snapshot or snapshot.get('id') != user_id:
+        if current_user() is None:
+            return None
+        snapshot = session['identity']
+    return Identity(**snapshot)
 
 def ensure_wallet(user):
     """Ensure a DataWallet exists for a user. Returns the wallet."""
@@ -101,22 +684,53 @@ def ensure_wallet(user):
     return user.wallet
 
 def simulate_end_of_day_rollover(user):
-    """If the last_usage_date is not today, roll leftover quota into wallet as 'earned' DataEntry (7d expiry)."""
+    """If the last_usage_date is not today, roll leftover quota into wallet as 'earned' DataEntry (7d expiry).
+
+    iter_bulk_rollover's statements for one user, in one transaction that
+    first claims the day with a conditional UPDATE of last_usage_date: only
+    one of several concurrent requests (or the bulk job) matches it, so the
+    user is credited at most once and lots, history and balance agree.
+    """
     if not user:
         return
+    user_id = user.id
     today = date.today()
     if user.last_usage_date == today:
         return
-    leftover = max(0, (user.daily_quota_mb or 0) - (user.used_today_mb or 0))
+    claimed = db.session.execute(
+        update(User.__table__)
+        .where(User.id == user_id, rollover_pending(today))
+        .values(last_usage_date=today)
+    ).rowcount
+    if not claimed:
+        db.session.rollback()
+        return
+    now = datetime.utcnow()
+    earned_expiry = now + timedelta(days=7)
+    leftover = db.session.execute(select(rollover_leftover()).where(User.id == user_id)).scalar()
+    db.session.execute(
+        insert(DataWallet.__table__).from_select(
+            ['user_id', 'balance_mb', 'total_purchased_mb', 'total_used_mb', 'created_at'],
+            select(User.id, literal(0), literal(0), literal(0), literal(now, DataWallet.created_at.type))
+            .where(User.id == user_id, ~User.id.in_(select(DataWallet.user_id)))
+        )
+    )
     if leftover > 0:
-        # Add as earned data entry (7-day expiry)
-        add_earned_data(user, leftover)
-        # record rollover as a Transaction for history
-        txn = Transaction(sender_id=None, receiver_id=user.id, amount_mb=leftover, note='Rollover (earned)')
-        db.session.add(txn)
-    user.used_today_mb = 0
-    user.last_usage_date = today
+        db.session.execute(insert(DataEntry.__table__).values(
+            user_id=user_id, amount_mb=leftover, source='earned', added_on=now, expiry_date=earned_expiry,
+        ))
+        db.session.execute(insert(Transaction.__table__).values(
+            sender_id=None, receiver_id=user_id, amount_mb=leftover, timestamp=now, note='Rollover (earned)',
+        ))
+        db.session.execute(
+            update(DataWallet.__table__)
+            .where(DataWallet.user_id == user_id)
+            .values(balance_mb=func.coalesce(DataWallet.balance_mb, 0) + leftover)
+        )
+    db.session.execute(update(User.__table__).where(User.id == user_id).values(used_today_mb=0))
     db.session.commit()
+    if leftover > 0:
+        expiry_scheduler.schedule(user_id, earned_expiry)
 
 def get_all_the_things():
     """Return data for the index page. Avoid returning None to the template."""
@@ -130,22 +744,852 @@ def get_all_the_things():
         ]
     }
 
-def cleanup_expired_entries(user):
-    """Remove expired entries (optional) or just ignore them when calculating active balance.
-    We'll delete expired entries to keep DB small."""
+def active_entries_stmt(user_id, now):
+    return select(DataEntry).where(DataEntry.user_id == user_id, DataEntry.expiry_date > now)
+
+def get_active_entries(user):
     now = datetime.utcnow()
-    expired = DataEntry.query.filter(DataEntry.user_id==user.id, DataEntry.expiry_date < now).all()
-    if expired:
-        for e in expired:
-            db.session.delete(e)
+    return db.session.execute(active_entries_stmt(user.id, now)).scalars().all()
+
+def older_than(before):
+    """Keyset filter for (timestamp, id) cursors; matches everything when before is None."""
+    if before is None:
+        return true()
+    return tuple_(Transaction.timestamp, Transaction.id) < tuple_(*before)
+
+def user_transactions_stmt(user_id, limit, before=None):
+    """Latest `limit` transactions sent or received by the user, older than the
+    optional (timestamp, id) cursor `before`.
+
+    Each side is read newest-first from its own (party, timestamp) index and the
+    two short lists are merged, instead of an OR filter that scans the table.
+    """
+    sides = [
+        select(Transaction.id, Transaction.timestamp)
+        .where(party == user_id, older_than(before))
+        .order_by(Transaction.timestamp.desc(), Transaction.id.desc())
+        .limit(limit)
+        .subquery()
+        .select()
+        for party in (Transaction.sender_id, Transaction.receiver_id)
+    ]
+    latest = union(*sides).subquery()
+    ids = select(latest.c.id).order_by(latest.c.timestamp.desc(), latest.c.id.desc()).limit(limit)
+    return (
+        select(Transaction)
+        .where(Transaction.id.in_(ids))
+        .order_by(Transaction.timestamp.desc(), Transaction.id.desc())
+    )
+
+def expired_entry_ids_stmt(now, limit):
+    return select(DataEntry.id).where(DataEntry.expiry_date < now).limit(limit)
+
+def recent_transactions_stmt(limit, before=None):
+    return (
+        select(Transaction)
+        .where(older_than(before))
+        .order_by(Transaction.timestamp.desc(), Transaction.id.desc())
+        .limit(limit)
+    )
+
+def encode_cursor(txn):
+    return f"{txn.timestamp.isoformat()}_{txn.id}"
+
+def decode_cursor(raw):
+    """Parse a cursor produced by encode_cursor; None for missing or malformed input."""
+    if not raw:
+        return None
+    try:
+        ts, txn_id = raw.rsplit('_', 1)
+        return datetime.fromisoformat(ts), int(txn_id)
+    except ValueError:
+        return None
+
+def transaction_page(stmt_for, page_size=None):
+    """Run one keyset page. stmt_for(limit, before) builds the statement; the
+    cursor comes from the request's `before` argument.
+    Returns (transactions, next_cursor or None)."""
+    page_size = page_size or app.config['TRANSACTIONS_PAGE_SIZE']
+    before = decode_cursor(request.args.get('before'))
+    txns = db.session.execute(stmt_for(page_size + 1, before)).scalars().all()
+    next_cursor = encode_cursor(txns[page_size - 1]) if len(txns) > page_size else None
+    return txns[:page_size], next_cursor
+
+# Ledger: every balance change is one conditional UPDATE, so concurrent
+# workers can never lose an update or overdraw a wallet.
+def valid_amount(amount_mb):
+    """True for an amount the ledger accepts: positive and at most MAX_AMOUNT_MB,
+    so it can be bound as a SQL integer."""
+    return 0 < amount_mb <= app.config['MAX_AMOUNT_MB']
+
+def ledger_debit(user_id, amount_mb, count_as_used=False):
+    """Take amount_mb from the user's wallet if (and only if) it is covered.
+    Returns True when the debit was applied. Does not commit."""
+    if not valid_amount(amount_mb):
+        return False  # no wallet can cover it
+    values = {'balance_mb': DataWallet.balance_mb - amount_mb}
+    if count_as_used:
+        values['total_used_mb'] = func.coalesce(DataWallet.total_used_mb, 0) + amount_mb
+    result = db.session.execute(
+        update(DataWallet.__table__)
+        .where(DataWallet.user_id == user_id, DataWallet.balance_mb >= amount_mb)
+        .values(**values)
+    )
+    return result.rowcount == 1
+
+def ledger_credit(user_id, amount_mb):
+    """Add amount_mb to the user's wallet, creating the wallet if needed. Does not commit."""
+    result = db.session.execute(
+        update(DataWallet.__table__)
+        .where(DataWallet.user_id == user_id)
+        .values(balance_mb=func.coalesce(DataWallet.balance_mb, 0) + amount_mb)
+    )
+    if result.rowcount == 0:
+        db.session.execute(insert(DataWallet.__table__).values(
+            user_id=user_id, balance_mb=amount_mb, total_purchased_mb=0, total_used_mb=0,
+            created_at=datetime.utcnow()
+        ))
+
+def ledger_credit_many(amounts):
+    """Credit several wallets ({user_id: amount_mb}) with one executemany UPDATE,
+    inserting the wallets that don't exist yet. Does not commit."""
+    if not amounts:
+        return
+    have_wallet = set(db.session.execute(
+        select(DataWallet.user_id).where(DataWallet.user_id.in_(amounts))
+    ).scalars())
+    if have_wallet:
+        db.session.execute(
+            update(DataWallet.__table__)
+            .where(DataWallet.user_id == bindparam('uid'))
+            .values(balance_mb=func.coalesce(DataWallet.balance_mb, 0) + bindparam('amount')),
+            [{'uid': uid, 'amount': amounts[uid]} for uid in have_wallet]
+        )
+    missing = [uid for uid in amounts if uid not in have_wallet]
+    if missing:
+        now = datetime.utcnow()
+        db.session.execute(insert(DataWallet.__table__), [
+            {'user_id': uid, 'balance_mb': amounts[uid], 'total_purchased_mb': 0, 'total_used_mb': 0,
+             'created_at': now, 'updated_at': now}
+            for uid in missing
+        ])
+
+def ledger_transfer(sender_id, receiver_id, amount_mb, note='Transfer'):
+    """Move amount_mb between wallets and record the Transaction in one short
+    transaction. Returns False (and changes nothing) if the sender can't cover it."""
+    try:
+        if not ledger_debit(sender_id, amount_mb):
+            db.session.rollback()
+            return False
+        ledger_credit(receiver_id, amount_mb)
+        db.session.execute(insert(Transaction.__table__).values(
+            sender_id=sender_id, receiver_id=receiver_id, amount_mb=amount_mb,
+            timestamp=datetime.utcnow(), note=note
+        ))
         db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return True
+
+def consume_lots(user_id, amount_mb, now=None):
+    """Burn amount_mb from the user's active DataEntry lots, soonest-expiring first.
+
+    A running SUM() over (expiry_date, id) picks the lots in one query; the fully
+    used ones go in a single DELETE and the one lot that is only partly used gets
+    a single UPDATE. Returns the MB taken from lots, which is less than amount_mb
+    only if the active lots don't cover it. Does not commit.
+    """
+    now = now or datetime.utcnow()
+    running = func.sum(DataEntry.amount_mb).over(order_by=(DataEntry.expiry_date, DataEntry.id))
+    lots = (
+        select(DataEntry.id, DataEntry.amount_mb, running.label('running'))
+        .where(DataEntry.user_id == user_id, DataEntry.expiry_date > now)
+        .subquery()
+    )
+    # Every lot that starts before the amount runs out is touched
+    touched = db.session.execute(
+        select(lots.c.id, lots.c.running)
+        .where(lots.c.running - lots.c.amount_mb < amount_mb)
+        .order_by(lots.c.running)
+    ).all()
+    if not touched:
+        return 0
+
+    spent = [lot_id for lot_id, total in touched if total <= amount_mb]
+    if spent:
+        db.session.execute(delete(DataEntry.__table__).where(DataEntry.id.in_(spent)))
+    last_id, last_total = touched[-1]
+    if last_total > amount_mb:
+        db.session.execute(
+            update(DataEntry.__table__)
+            .where(DataEntry.id == last_id)
+            .values(amount_mb=last_total - amount_mb)
+        )
+        return amount_mb
+    return last_total
 
-def get_active_entries(user):
+def use_wallet_data(user_id, amount_mb):
+    """Spend amount_mb from the wallet: conditional debit, lot consumption and
+    usage counters in one transaction. Returns False if the balance is short."""
+    try:
+        if not ledger_debit(user_id, amount_mb, count_as_used=True):
+            db.session.rollback()
+            return False
+        consume_lots(user_id, amount_mb)
+        record_usage(user_id, amount_mb)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return True
+
+def use_daily_quota(user_id, amount_mb):
+    """Count amount_mb against today's quota if (and only if) enough is left.
+    One conditional UPDATE; returns False when the quota is short. Does not commit."""
+    if not valid_amount(amount_mb):
+        return False  # no quota covers it
+    result = db.session.execute(
+        update(User.__table__)
+        .where(
+            User.id == user_id,
+            func.coalesce(User.daily_quota_mb, 0) - func.coalesce(User.used_today_mb, 0) >= amount_mb,
+        )
+        .values(
+            used_today_mb=func.coalesce(User.used_today_mb, 0) + amount_mb,
+            total_used_mb=func.coalesce(User.total_used_mb, 0) + amount_mb,
+        )
+    )
+    return result.rowcount == 1
+
+def ledger_purchase(user_id, amount_mb):
+    """Credit a data purchase: wallet balance and purchase total, a 30-day lot
+    and the history row, in one transaction."""
     now = datetime.utcnow()
-    return DataEntry.query.filter(
-        DataEntry.user_id == user.id,
-        DataEntry.expiry_date > now
+    expiry = now + timedelta(days=30)
+    try:
+        ledger_credit(user_id, amount_mb)
+        db.session.execute(
+            update(DataWallet.__table__)
+            .where(DataWallet.user_id == user_id)
+            .values(total_purchased_mb=func.coalesce(DataWallet.total_purchased_mb, 0) + amount_mb)
+        )
+        db.session.execute(insert(DataEntry.__table__).values(
+            user_id=user_id, amount_mb=amount_mb, source='purchased', added_on=now, expiry_date=expiry
+        ))
+        db.session.execute(insert(Transaction.__table__).values(
+            sender_id=None, receiver_id=user_id, amount_mb=amount_mb, timestamp=now,
+            note=f"Bought {amount_mb} MB of data"
+        ))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    expiry_scheduler.schedule(user_id, expiry)
+
+def ledger_batch_transfer(sender_id, items, note='Transfer'):
+    """Pay several recipients from one wallet in a single transaction.
+
+    items is a list of (email, amount_mb). Recipients are resolved with one IN
+    query and the sender is debited once for the total of the valid items, so
+    the batch is applied completely or (if the balance is short) not at all.
+    Returns (applied, results) with one result dict per item, in input order.
+    """
+    results = []
+    for index, (email, amount) in enumerate(items):
+        email = email.strip().lower() if isinstance(email, str) else ''
+        ok = email and isinstance(amount, int) and not isinstance(amount, bool) and valid_amount(amount)
+        results.append({'index': index, 'email': email, 'amount_mb': amount,
+                        'status': 'pending' if ok else 'invalid'})
+
+    wanted = {r['email'] for r in results if r['status'] == 'pending'}
+    ids = dict(db.session.execute(select(User.email, User.id).where(User.email.in_(wanted))).all()) if wanted else {}
+    credits, rows = {}, []
+    now = datetime.utcnow()
+    for r in results:
+        if r['status'] != 'pending':
+            continue
+        receiver_id = ids.get(r['email'])
+        if receiver_id is None:
+            r['status'] = 'not_found'
+            continue
+        credits[receiver_id] = credits.get(receiver_id, 0) + r['amount_mb']
+        rows.append({'sender_id': sender_id, 'receiver_id': receiver_id, 'amount_mb': r['amount_mb'],
+                     'timestamp': now, 'note': note})
+        r['status'] = 'ok'
+
+    total = sum(credits.values())
+    if not total:
+        return False, results
+    try:
+        if not ledger_debit(sender_id, total):
+            db.session.rollback()
+            for r in results:
+                if r['status'] == 'ok':
+                    r['status'] = 'insufficient_balance'
+            return False, results
+        ledger_credit_many(credits)
+        db.session.execute(insert(Transaction.__table__), rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return True, results
+
+def record_usage(user_id, amount_mb):
+    """Add amount_mb to the user's all-time usage counter. Does not commit."""
+    db.session.execute(
+        update(User.__table__)
+        .where(User.id == user_id)
+        .values(total_used_mb=func.coalesce(User.total_used_mb, 0) + amount_mb)
+    )
+
+def dashboard_data(user_id, now=None, today=None):
+    """Everything /dashboard renders, from one read-only query.
+
+    User, wallet and active lots come back as a single LEFT JOIN with window
+    totals. A day's rollover that hasn't been materialised yet (by the nightly
+    bulk_rollover or the next write) is applied in the query: used-today reads
+    as 0 and the leftover shows up in the balance as a pending earned lot.
+    Returns template keyword arguments, or None if the user doesn't exist.
+    """
+    now = now or datetime.utcnow()
+    today = today or date.today()
+    quota = func.coalesce(User.daily_quota_mb, 0)
+    used = func.coalesce(User.used_today_mb, 0)
+    rolled = User.last_usage_date == today
+    rows = db.session.execute(
+        select(
+            User.name, User.is_admin, User.last_usage_date, quota.label('daily_quota_mb'),
+            case((rolled, used), else_=0).label('used_today_mb'),
+            case((rolled, 0), (quota > used, quota - used), else_=0).label('pending_rollover_mb'),
+            func.coalesce(DataWallet.balance_mb, 0).label('balance_mb'),
+            func.coalesce(DataWallet.total_purchased_mb, 0).label('total_purchased_mb'),
+            func.coalesce(DataWallet.total_used_mb, 0).label('wallet_used_mb'),
+            DataEntry.id.label('entry_id'), DataEntry.amount_mb, DataEntry.source,
+            DataEntry.added_on, DataEntry.expiry_date,
+            func.coalesce(func.sum(DataEntry.amount_mb).over(), 0).label('lots_mb'),
+        )
+        .outerjoin(DataWallet, DataWallet.user_id == User.id)
+        .outerjoin(DataEntry, (DataEntry.user_id == User.id) & (DataEntry.expiry_date > now))
+        .where(User.id == user_id)
+        .order_by(DataEntry.expiry_date)
     ).all()
+    if not rows:
+        return None
+
+    head = rows[0]
+    user = SimpleNamespace(
+        id=user_id, name=head.name, is_admin=head.is_admin, last_usage_date=head.last_usage_date,
+        daily_quota_mb=head.daily_quota_mb, used_today_mb=head.used_today_mb,
+    )
+    wallet = SimpleNamespace(
+        balance_mb=head.balance_mb + head.pending_rollover_mb,
+        total_purchased_mb=head.total_purchased_mb,
+        total_used_mb=head.wallet_used_mb,
+    )
+    active_entries = [
+        SimpleNamespace(id=r.entry_id, amount_mb=r.amount_mb, source=r.source,
+                        added_on=r.added_on, expiry_date=r.expiry_date)
+        for r in rows if r.entry_id is not None
+    ]
+    if head.pending_rollover_mb:
+        active_entries.append(SimpleNamespace(
+            id=None, amount_mb=head.pending_rollover_mb, source='earned',
+            added_on=now, expiry_date=now + timedelta(days=7)
+        ))
+
+    expiring_soon = []
+    if expiry_scheduler.may_expire_before(user_id, now + timedelta(days=4)):
+        expiring_soon = [e for e in active_entries if (e.expiry_date - now).days <= 3]
+
+    return dict(
+        user=user,
+        wallet=wallet,
+        active_entries=active_entries,
+        total_active_mb=head.lots_mb + head.pending_rollover_mb,
+        expiring_soon=expiring_soon,
+        remaining_today=max(user.daily_quota_mb - user.used_today_mb, 0),
+        total_used_mb=user.used_today_mb,
+        total_all_time=user.used_today_mb + wallet.total_used_mb,
+        wallet_balance=wallet.balance_mb,
+    )
+
+def reconcile_wallets(batch_size=1000, since=None, now=None):
+    """Compare each DataWallet.balance_mb with the sum of the user's active lots.
+
+    Walks users in id-ordered keyset batches, so memory stays bounded by
+    batch_size whatever the table sizes. With `since`, only users whose wallet
+    changed (updated_at), who got a lot (added_on) after that time or who still
+    have no wallet are checked; that set is read from the indexes, not by
+    filtering every user. Report only: transfers move balance without moving
+    lots, so the lot total is not a safe value to write back.
+    Yields one stats dict per batch: checked, drifted, drift_mb, seconds and
+    the drifted rows themselves.
+    """
+    now = now or datetime.utcnow()
+    lots_mb = (
+        select(func.coalesce(func.sum(DataEntry.amount_mb), 0))
+        .where(DataEntry.user_id == User.id, DataEntry.expiry_date > now)
+        .scalar_subquery()
+    )
+    base = (
+        select(User.id, DataWallet.id.label('wallet_id'),
+               func.coalesce(DataWallet.balance_mb, 0).label('balance_mb'),
+               lots_mb.label('lots_mb'))
+        .outerjoin(DataWallet, DataWallet.user_id == User.id)
+    )
+
+    walletless, walletless_cursor = [], 0  # users without a wallet, read ahead in id order
+
+    def touched_ids(last_id):
+        """Next batch of user ids changed since `since`. Wallet and lot changes are
+        found through the updated_at / added_on indexes; users without a wallet
+        need a walk of the user table, done once per run in batch_size steps."""
+        nonlocal walletless, walletless_cursor
+        changed = union(
+            select(DataWallet.user_id).where(DataWallet.updated_at > since, DataWallet.user_id > last_id),
+            select(DataEntry.user_id).where(DataEntry.added_on > since, DataEntry.user_id > last_id),
+        ).subquery()
+        ids = db.session.execute(
+            select(changed.c.user_id).order_by(changed.c.user_id).limit(batch_size)
+        ).scalars().all()
+        walletless = [uid for uid in walletless if uid > last_id]
+        if not walletless and walletless_cursor is not None:
+            walletless = db.session.execute(
+                select(User.id)
+                .where(User.id > max(walletless_cursor, last_id), ~exists().where(DataWallet.user_id == User.id))
+                .order_by(User.id).limit(batch_size)
+            ).scalars().all()
+            walletless_cursor = walletless[-1] if len(walletless) == batch_size else None
+        # Beyond walletless_cursor there may be wallet-less users not read yet
+        return sorted(uid for uid in set(ids) | set(walletless)
+                      if walletless_cursor is None or uid <= walletless_cursor)[:batch_size]
+
+    last_id = 0
+    while True:
+        started = time.perf_counter()
+        if since is None:
+            rows = db.session.execute(base.where(User.id > last_id).order_by(User.id).limit(batch_size)).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+        else:
+            ids = touched_ids(last_id)
+            if not ids:
+                break
+            last_id = ids[-1]
+            rows = db.session.execute(base.where(User.id.in_(ids)).order_by(User.id)).all()
+        drifted = [r for r in rows if r.wallet_id is None or r.balance_mb != r.lots_mb]
+        db.session.rollback()  # end the read transaction between batches
+        yield {
+            'checked': len(rows),
+            'drifted': len(drifted),
+            'drift_mb': sum(r.balance_mb - r.lots_mb for r in drifted),
+            'seconds': time.perf_counter() - started,
+            'rows': drifted,
+        }
+
+EXPORT_FIELDS = ['id', 'timestamp', 'sender_id', 'sender_email', 'receiver_id', 'receiver_email', 'amount_mb', 'note']
+
+def export_transactions(stmt_for, fmt='csv', batch_size=None):
+    """Yield a transaction export chunk by chunk (one chunk per batch).
+
+    stmt_for(limit, before) builds a keyset page, as for transaction_page(), so
+    only one batch of rows is ever held in memory.
+    """
+    batch_size = batch_size or app.config['EXPORT_BATCH_SIZE']
+    if fmt == 'csv':
+        buf = io.StringIO()
+        csv.writer(buf).writerow(EXPORT_FIELDS)
+        yield buf.getvalue()
+    before = None
+    while True:
+        txns = db.session.execute(stmt_for(batch_size, before)).scalars().all()
+        if not txns:
+            break
+        emails = counterparty_emails(txns)
+        buf = io.StringIO()
+        writer = csv.writer(buf) if fmt == 'csv' else None
+        for t in txns:
+            row = [t.id, t.timestamp.isoformat() if t.timestamp else None,
+                   t.sender_id, emails.get(t.sender_id), t.receiver_id, emails.get(t.receiver_id),
+                   t.amount_mb, t.note]
+            if writer:
+                writer.writerow(row)
+            else:
+                buf.write(json.dumps(dict(zip(EXPORT_FIELDS, row)), separators=(',', ':')))
+                buf.write('\n')
+        yield buf.getvalue()
+        before = (txns[-1].timestamp, txns[-1].id)
+        for t in txns:
+            db.session.expunge(t)
+        if len(txns) < batch_size:
+            break
+
+def gzip_stream(chunks):
+    """Compress a text stream on the fly, flushing after every chunk so the
+    client keeps receiving bytes while the export runs."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    for chunk in chunks:
+        yield compressor.compress(chunk.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+def export_response(stmt_for, basename):
+    """Streaming CSV/NDJSON download for ?format= (csv|ndjson) and ?gzip=1."""
+    fmt = 'ndjson' if request.args.get('format') == 'ndjson' else 'csv'
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    filename = f"{basename}.{fmt}"
+    body = export_transactions(stmt_for, fmt)
+    if request.args.get('gzip') in ('1', 'true'):
+        body = gzip_stream(body)
+        mimetype = 'application/gzip'
+        filename += '.gz'
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+# Sortable columns of the admin user list
+ADMIN_USER_COLUMNS = {
+    'id': User.id,
+    'email': User.email,
+    'balance': func.coalesce(DataWallet.balance_mb, 0),
+    'quota': User.daily_quota_mb,
+    'usage': User.used_today_mb,
+    'last_login': User.last_login,
+}
+
+# Columns with ?min_<col>= / ?max_<col>= filters, and how their values are parsed
+ADMIN_USER_RANGE_FILTERS = {
+    'balance': int,
+    'quota': int,
+    'usage': int,
+    'last_login': datetime.fromisoformat,
+}
+
+# Query args of the admin user list carried over by its pager
+ADMIN_USER_FILTERS = ('email', 'sort', 'order') + tuple(
+    f'{bound}_{key}' for key in ADMIN_USER_RANGE_FILTERS for bound in ('min', 'max')
+)
+
+def admin_user_rows(args, page_size=None):
+    """One page of the admin user list as lightweight rows.
+
+    A single User LEFT JOIN DataWallet projection; supports ?email= (prefix),
+    ?min_<col>= / ?max_<col>= range filters (ADMIN_USER_RANGE_FILTERS),
+    ?sort=<col>, ?order=asc|desc and ?page=. Returns (rows, page, has_next).
+    """
+    page_size = page_size or app.config['ADMIN_USERS_PAGE_SIZE']
+    page = max(args.get('page', 1, type=int), 1)
+    sort_col = ADMIN_USER_COLUMNS.get(args.get('sort'), User.id)
+    direction = 'desc' if args.get('order') == 'desc' else 'asc'
+
+    stmt = (
+        select(
+            User.id, User.name, User.email, User.daily_quota_mb, User.used_today_mb,
+            User.total_used_mb, User.last_login, User.is_admin, User.data_version, User.session_version,
+            ADMIN_USER_COLUMNS['balance'].label('balance_mb'),
+        )
+        .outerjoin(DataWallet, DataWallet.user_id == User.id)
+    )
+    prefix = (args.get('email') or '').strip().lower()
+    if prefix:
+        # Range instead of LIKE so the unique email index can be used
+        stmt = stmt.where(User.email >= prefix, User.email < prefix + '\uffff')
+    for key, value_type in ADMIN_USER_RANGE_FILTERS.items():
+        col = ADMIN_USER_COLUMNS[key]
+        low = args.get(f'min_{key}', type=value_type)
+        high = args.get(f'max_{key}', type=value_type)
+        if low is not None:
+            stmt = stmt.where(col >= low)
+        if high is not None:
+            stmt = stmt.where(col <= high)
+
+    order = sort_col.desc() if direction == 'desc' else sort_col.asc()
+    tiebreak = User.id.desc() if direction == 'desc' else User.id.asc()
+    rows = db.session.execute(
+        stmt.order_by(order, tiebreak).limit(page_size + 1).offset((page - 1) * page_size)
+    ).all()
+    return rows[:page_size], page, len(rows) > page_size
+
+MARKETPLACE_SORTS = ('newest', 'price_asc', 'price_desc')
+MARKETPLACE_FILTERS = ('q', 'min_price', 'max_price', 'sort')  # query args carried over by the pager
+
+def fts_query(text):
+    """Turn free text into a safe FTS5 query: every word must match, as a prefix."""
+    words = re.findall(r'\w+', text)
+    return ' '.join(f'"{w}"*' for w in words)
+
+def marketplace_stmt(limit, query=None, min_price=None, max_price=None, sort='newest', after=None):
+    """Listings matching the search, ordered by `sort`, after the optional keyset
+    cursor: an id for 'newest', a (price, id) pair for the price sorts.
+    Plain rows rather than entities, so results can outlive the session."""
+    stmt = select(DataItem.id, DataItem.title, DataItem.description, DataItem.price, DataItem.seller_id)
+    if query:
+        if db.engine.dialect.name == 'sqlite':
+            matches = select(data_item_fts.c.rowid).where(data_item_fts.c.data_item_fts.op('MATCH')(fts_query(query)))
+            stmt = stmt.where(DataItem.id.in_(matches))
+        else:
+            pattern = f"%{query}%"
+            stmt = stmt.where(or_(DataItem.title.ilike(pattern), DataItem.description.ilike(pattern)))
+    if min_price is not None:
+        stmt = stmt.where(DataItem.price >= min_price)
+    if max_price is not None:
+        stmt = stmt.where(DataItem.price <= max_price)
+
+    if sort == 'newest':
+        if after is not None:
+            stmt = stmt.where(DataItem.id < after)
+        stmt = stmt.order_by(DataItem.id.desc())
+    elif sort == 'price_desc':
+        if after is not None:
+            stmt = stmt.where(tuple_(DataItem.price, DataItem.id) < tuple_(*after))
+        stmt = stmt.order_by(DataItem.price.desc(), DataItem.id.desc())
+    else:
+        if after is not None:
+            stmt = stmt.where(tuple_(DataItem.price, DataItem.id) > tuple_(*after))
+        stmt = stmt.order_by(DataItem.price.asc(), DataItem.id.asc())
+    return stmt.limit(limit)
+
+def marketplace_cursor(item, sort):
+    return str(item.id) if sort == 'newest' else f"{item.price!r}_{item.id}"
+
+def decode_marketplace_cursor(raw, sort):
+    if not raw:
+        return None
+    try:
+        if sort == 'newest':
+            return int(raw)
+        price, item_id = raw.rsplit('_', 1)
+        return float(price), int(item_id)
+    except ValueError:
+        return None
+
+class LRUCache:
+    """Thread-safe in-process LRU cache with a TTL, an entry limit and an
+    approximate memory bound.
+
+    invalidate() drops everything and bumps `generation`; a value computed
+    under an older generation is never stored, so a page rendered while a
+    write was committing cannot outlive the invalidation. Invalidation is
+    per process: other workers catch up when their entries hit the TTL.
+    """
+
+    def __init__(self, app, prefix):
+        self.app = app
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self.bytes = 0
+        self.generation = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def _config(self, name):
+        return self.app.config[f'{self.prefix}_{name}']
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, value, size, generation=None):
+        max_bytes = self._config('MAX_BYTES')
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if size > max_bytes:
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self._config('TTL'), size, value)
+            self.bytes += size
+            while len(self._entries) > self._config('MAX_ENTRIES') or self.bytes > max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_or_set(self, key, compute, size, generation=None):
+        """Cached value for key, else compute() stored with size(value) bytes.
+        Pass the generation read before computing anything the value derives
+        from, when that started earlier than this call."""
+        generation = self.generation if generation is None else generation
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value, size(value), generation)
+        return value
+
+    def _drop(self, key):
+        self.bytes -= self._entries.pop(key)[1]
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries), 'bytes': self.bytes, 'generation': self.generation,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+            }
+
+marketplace_cache = LRUCache(app, 'MARKETPLACE_CACHE')
+
+# Any committed write to data_item invalidates the marketplace cache: ORM
+# adds/changes/deletes are seen at flush, Core statements at execute.
+@event.listens_for(RoutingSession, 'after_flush')
+def note_marketplace_flush(session, flush_context):
+    if any(isinstance(obj, DataItem) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info['marketplace_dirty'] = True
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def note_marketplace_statement(state):
+    if (state.is_insert or state.is_update or state.is_delete) and state.statement.table.name == DataItem.__tablename__:
+        state.session.info['marketplace_dirty'] = True
+
+@event.listens_for(RoutingSession, 'after_commit')
+def invalidate_marketplace_cache(session):
+    if session.info.pop('marketplace_dirty', False):
+        marketplace_cache.invalidate()
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def forget_marketplace_writes(session):
+    session.info.pop('marketplace_dirty', None)
+
+# Templates: compiled bytecode persists across worker restarts, expensive
+# blocks can be cached with {% cache 'name', key... %}...{% endcache %}, and
+# every render is timed.
+fragment_cache = LRUCache(app, 'FRAGMENT_CACHE')
+
+class FragmentCacheExtension(Extension):
+    """`{% cache 'name', part, ... %}body{% endcache %}` renders body once per
+    distinct key and serves it from fragment_cache afterwards. Key parts should
+    carry the data version of whatever the body shows."""
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cached', [nodes.List(parts)]), [], [], body).set_lineno(lineno)
+
+    def _cached(self, parts, caller):
+        key = ('fragment', parts[0], hashlib.sha1(repr(parts[1:]).encode()).hexdigest())
+        return fragment_cache.get_or_set(key, caller, size=len)
+
+class TemplateTimings:
+    """Render count, total and worst time per template, plus the renders of the
+    current request for its Server-Timing header."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, name, seconds):
+        with self._lock:
+            stat = self._stats.setdefault(name, {'renders': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            stat['renders'] += 1
+            stat['total_ms'] += seconds * 1000
+            stat['max_ms'] = max(stat['max_ms'], seconds * 1000)
+        if has_request_context():
+            g.setdefault('template_timings', []).append((name, seconds))
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: dict(stat, avg_ms=stat['total_ms'] / stat['renders'])
+                for name, stat in sorted(self._stats.items())
+            }
+
+template_timings = TemplateTimings()
+
+class TimedTemplate(Template):
+    def render(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            template_timings.record(self.name, time.perf_counter() - started)
+
+os.makedirs(app.config['JINJA_BYTECODE_CACHE_DIR'], exist_ok=True)
+app.jinja_options = dict(
+    app.jinja_options,
+    bytecode_cache=FileSystemBytecodeCache(app.config['JINJA_BYTECODE_CACHE_DIR']),
+    extensions=[FragmentCacheExtension],
+)
+app.jinja_env.template_class = TimedTemplate
+
+@app.after_request
+def add_server_timing(response):
+    renders = g.pop('template_timings', None)
+    if renders:
+        response.headers.add('Server-Timing', ', '.join(
+            f'render;desc="{name}";dur={seconds * 1000:.2f}' for name, seconds in renders
+        ))
+    return response
+
+def marketplace_key(args, page_size=None):
+    """Normalized (page_size, sort, query, min_price, max_price, after) for a request."""
+    sort = args.get('sort') if args.get('sort') in MARKETPLACE_SORTS else 'newest'
+    query = (args.get('q') or '').strip()
+    return (
+        page_size or app.config['MARKETPLACE_PAGE_SIZE'],
+        sort,
+        query if fts_query(query) else None,
+        args.get('min_price', type=float),
+        args.get('max_price', type=float),
+        decode_marketplace_cursor(args.get('after'), sort),
+    )
+
+def marketplace_page(args, page_size=None, generation=None):
+    """One page of marketplace search for ?q=, ?min_price=, ?max_price=, ?sort=
+    and the ?after= cursor, served from marketplace_cache when possible.
+    Returns (key, items, sellers, next_cursor), where sellers maps seller id ->
+    name for the page, loaded in one query. generation is passed on to
+    marketplace_cache.get_or_set."""
+    key = marketplace_key(args, page_size)
+
+    def load():
+        page_size, sort, query, min_price, max_price, after = key
+        items = db.session.execute(marketplace_stmt(
+            page_size + 1, query=query, min_price=min_price, max_price=max_price, sort=sort, after=after,
+        )).all()
+        next_cursor = marketplace_cursor(items[page_size - 1], sort) if len(items) > page_size else None
+        items = items[:page_size]
+        seller_ids = {item.seller_id for item in items}
+        sellers = dict(db.session.execute(
+            select(User.id, User.name).where(User.id.in_(seller_ids))
+        ).all()) if seller_ids else {}
+        return items, sellers, next_cursor
+
+    items, sellers, next_cursor = marketplace_cache.get_or_set(
+        ('rows', key), load, size=marketplace_rows_size, generation=generation
+    )
+    return key, items, sellers, next_cursor
+
+def marketplace_rows_size(result):
+    items, sellers, _ = result
+    return sum(len(i.title) + len(i.description) + 64 for i in items) + 64 * len(sellers) + 128
+
+def counterparty_emails(txns):
+    """Map user id -> email for every sender/receiver on a page, in one query."""
+    ids = {t.sender_id for t in txns} | {t.receiver_id for t in txns}
+    ids.discard(None)
+    if not ids:
+        return {}
+    return dict(db.session.execute(select(User.id, User.email).where(User.id.in_(ids))).all())
 def total_active_mb(user):
     entries = get_active_entries(user)
     return sum(e.amount_mb for e in entries)
@@ -162,7 +1606,8 @@ def create_entry(user_id, amount_mb, source):
     )
     db.session.add(entry)
     db.session.commit()
-    print(f"✅ Created data entry: {amount_mb}MB ({source}) for user {user_id}")
+    expiry_scheduler.schedule(user_id, expiry)
+    log_event(logging.DEBUG, 'entry_created', user_id=user_id, amount_mb=amount_mb, source=source)
     return entry
 def add_purchased_data(user, amount_mb):
     """Add purchased data (30 days expiry) and update DataWallet summary."""
@@ -178,11 +1623,604 @@ def add_earned_data(user, amount_mb):
     wallet = ensure_wallet(user)
     wallet.balance_mb = (wallet.balance_mb or 0) + amount_mb
     db.session.commit()
+
+def rollover_pending(today):
+    """Users whose day has not been rolled over yet."""
+    return or_(User.last_usage_date.is_(None), User.last_usage_date != today)
+
+def rollover_leftover():
+    """Unused daily quota that a rollover moves into the wallet."""
+    quota = func.coalesce(User.daily_quota_mb, 0)
+    used = func.coalesce(User.used_today_mb, 0)
+    return case((quota > used, quota - used), else_=0)
+
+def bulk_rollover(chunk_size=None, today=None):
+    """Set-based version of simulate_end_of_day_rollover for every user.
+
+    Users are processed in id-ordered chunks; each chunk is one short transaction
+    of a few INSERT ... SELECT / UPDATE statements instead of several commits per
+    user. Returns a list of per-chunk stats (users, rolled-over MB, seconds).
+    """
+    return list(iter_bulk_rollover(chunk_size, today))
+
+def iter_bulk_rollover(chunk_size=None, today=None):
+    """bulk_rollover one chunk at a time: yields each chunk's stats after its commit."""
+    chunk_size = chunk_size or app.config['ROLLOVER_CHUNK_SIZE']
+    today = today or date.today()
+    now = datetime.utcnow()
+    earned_expiry = now + timedelta(days=7)
+
+    leftover = rollover_leftover()
+    pending = rollover_pending(today)
+
+    chunk_no = 0
+    last_id = 0
+    while True:
+        started = time.perf_counter()
+        ids = db.session.execute(
+            select(User.id).where(pending, User.id > last_id).order_by(User.id).limit(chunk_size)
+        ).scalars().all()
+        if not ids:
+            break
+        last_id = ids[-1]
+        # Re-check pending in every statement: a request may have rolled one of
+        # these users over (simulate_end_of_day_rollover) since the ids were read
+        in_chunk = and_(User.id.in_(ids), pending)
+        credited = db.session.execute(
+            select(func.count(User.id), func.coalesce(func.sum(leftover), 0)).where(in_chunk, leftover > 0)
+        ).one()
+
+        # Wallets first, so the balance credit below reaches every user
+        db.session.execute(
+            insert(DataWallet.__table__).from_select(
+                ['user_id', 'balance_mb', 'total_purchased_mb', 'total_used_mb', 'created_at'],
+                select(User.id, literal(0), literal(0), literal(0), literal(now, DataWallet.created_at.type))
+                .where(in_chunk, ~User.id.in_(select(DataWallet.user_id)))
+            )
+        )
+        db.session.execute(
+            insert(DataEntry.__table__).from_select(
+                ['user_id', 'amount_mb', 'source', 'added_on', 'expiry_date'],
+                select(User.id, leftover, literal('earned'),
+                       literal(now, DataEntry.added_on.type),
+                       literal(earned_expiry, DataEntry.expiry_date.type))
+                .where(in_chunk, leftover > 0)
+            )
+        )
+        db.session.execute(
+            insert(Transaction.__table__).from_select(
+                ['sender_id', 'receiver_id', 'amount_mb', 'timestamp', 'note'],
+                select(null(), User.id, leftover,
+                       literal(now, Transaction.timestamp.type),
+                       literal('Rollover (earned)'))
+                .where(in_chunk, leftover > 0)
+            )
+        )
+        db.session.execute(
+            update(DataWallet.__table__)
+            .where(DataWallet.user_id.in_(select(User.id).where(in_chunk)))
+            .values(balance_mb=func.coalesce(DataWallet.balance_mb, 0) + (
+                select(leftover).where(User.id == DataWallet.user_id).scalar_subquery()
+            ))
+        )
+        db.session.execute(
+            update(User.__table__)
+            .where(in_chunk)
+            .values(used_today_mb=0, last_usage_date=today)
+        )
+        db.session.commit()
+        if credited[0]:
+            for uid in ids:
+                expiry_scheduler.schedule(uid, earned_expiry)
+        chunk_no += 1
+        yield {
+            'chunk': chunk_no,
+            'users': len(ids),
+            'credited_users': credited[0],
+            'credited_mb': credited[1],
+            'seconds': round(time.perf_counter() - started, 4),
+        }
+
+class ExpiryScheduler:
+    """Background purger for expired DataEntry lots.
+
+    Keeps a min-heap of (earliest expiry_date, user_id) plus the earliest known
+    expiry per user, sleeps until the next lot is due (capped at
+    EXPIRY_POLL_SECONDS) and deletes expired rows in bounded bulk DELETE chunks.
+    The per-user value is a lower bound: consumed or purged lots can leave it
+    early, never late, so callers may only use it to skip work.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._heap = []
+        self._next_by_user = {}
+        self._thread = None
+        self._loaded_at = None
+        self.purged_total = 0
+
+    @property
+    def loaded(self):
+        return self._loaded_at is not None
+
+    def start(self):
+        """Start the purge thread once per process."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='expiry-scheduler', daemon=True)
+        self._thread.start()
+
+    def load(self):
+        """(Re)build the index from one grouped query over active lots."""
+        rows = db.session.execute(
+            select(DataEntry.user_id, func.min(DataEntry.expiry_date))
+            .group_by(DataEntry.user_id)
+        ).all()
+        with self._lock:
+            self._next_by_user = {uid: expiry for uid, expiry in rows}
+            self._heap = [(expiry, uid) for uid, expiry in rows]
+            heapq.heapify(self._heap)
+            self._loaded_at = time.monotonic()
+
+    def schedule(self, user_id, expiry_date):
+        """Record a newly created lot; only an earlier expiry changes anything."""
+        with self._lock:
+            current = self._next_by_user.get(user_id)
+            if current is not None and current <= expiry_date:
+                return
+            self._next_by_user[user_id] = expiry_date
+            heapq.heappush(self._heap, (expiry_date, user_id))
+            if self._heap[0][1] == user_id:
+                self._wakeup.set()
+
+    def next_expiry(self, user_id):
+        """Earliest expiry of the user's lots, or None if they have none."""
+        with self._lock:
+            return self._next_by_user.get(user_id)
+
+    def may_expire_before(self, user_id, cutoff):
+        """False only when the index proves no lot of the user expires before cutoff."""
+        if not self.loaded:
+            return True
+        nxt = self.next_expiry(user_id)
+        return nxt is not None and nxt <= cutoff
+
+    def seconds_until_due(self):
+        with self._lock:
+            if not self._heap:
+                return None
+            return (self._heap[0][0] - datetime.utcnow()).total_seconds()
+
+    def purge_expired(self, now=None, chunk_size=None):
+        """Delete every lot expired at `now` in chunks of at most chunk_size rows.
+        Each chunk commits separately so the write lock is held only briefly."""
+        return sum(self.iter_purge_expired(now, chunk_size))
+
+    def iter_purge_expired(self, now=None, chunk_size=None):
+        """purge_expired one chunk at a time: yields each chunk's row count after its
+        commit. If abandoned early, the due index catches up on the next pass."""
+        now = now or datetime.utcnow()
+        chunk_size = chunk_size or self.app.config['EXPIRY_PURGE_CHUNK_SIZE']
+        while True:
+            batch = db.session.execute(
+                select(DataEntry.id, DataEntry.user_id).where(DataEntry.id.in_(expired_entry_ids_stmt(now, chunk_size)))
+            ).all()
+            if batch:
+                # Expiry changes the user's true balance, so flag the wallets for reconciliation
+                db.session.execute(
+                    update(DataWallet.__table__)
+                    .where(DataWallet.user_id.in_({uid for _, uid in batch}))
+                    .values(updated_at=now)
+                )
+                db.session.execute(delete(DataEntry.__table__).where(DataEntry.id.in_([eid for eid, _ in batch])))
+            db.session.commit()
+            self.purged_total += len(batch)
+            yield len(batch)
+            if len(batch) < chunk_size:
+                break
+        self._refresh_due(now)
+
+    def _refresh_due(self, now):
+        """Pop users whose earliest lot is due and re-read their next expiry."""
+        with self._lock:
+            due = set()
+            while self._heap and self._heap[0][0] < now:
+                expiry, uid = heapq.heappop(self._heap)
+                if self._next_by_user.get(uid) == expiry:
+                    due.add(uid)
+        if not due:
+            return
+        rows = db.session.execute(
+            select(DataEntry.user_id, func.min(DataEntry.expiry_date))
+            .where(DataEntry.user_id.in_(due))
+            .group_by(DataEntry.user_id)
+        ).all()
+        with self._lock:
+            for uid in due:
+                self._next_by_user.pop(uid, None)
+            for uid, expiry in rows:
+                self._next_by_user[uid] = expiry
+                heapq.heappush(self._heap, (expiry, uid))
+
+    def _run(self):
+        poll = self.app.config['EXPIRY_POLL_SECONDS']
+        reload_every = self.app.config['EXPIRY_RELOAD_SECONDS']
+        while True:
+            try:
+                with self.app.app_context():
+                    if not self.loaded or time.monotonic() - self._loaded_at > reload_every:
+                        self.load()
+                    due_in = self.seconds_until_due()
+                    if due_in is not None and due_in <= 0:
+                        self.purge_expired()
+                        continue
+            except Exception:
+                logger.exception('expiry purge failed')
+                due_in = None
+            self._wakeup.wait(poll if due_in is None else min(poll, due_in))
+            self._wakeup.clear()
+
+expiry_scheduler = ExpiryScheduler(app)
+
+class ActivityBuffer:
+    """Write-behind buffer for non-critical User columns (last_login, last_seen_at,
+    page_views).
+
+    Requests only record values in memory; a background thread writes them out
+    every ACTIVITY_FLUSH_SECONDS as executemany UPDATEs, one statement per
+    distinct set of columns. Absolute values keep the latest write, counters are
+    summed and applied as `col = col + n`. Pending updates are flushed at exit;
+    a hard crash loses at most one interval of telemetry.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._values = {}  # user_id -> {column: latest value}
+        self._counters = {}  # user_id -> {column: pending increment}
+        self._thread = None
+        self._exit_hook = False
+        self.flushed_total = 0
+
+    def start(self):
+        """Start the flush thread once per process."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='activity-buffer', daemon=True)
+        self._thread.start()
+
+    def _pending(self):
+        if not self._exit_hook:
+            self._exit_hook = True
+            atexit.register(self._flush_at_exit)
+        limit = self.app.config['ACTIVITY_MAX_PENDING']
+        # Users usually sit in both dicts; the summed length only bounds the count
+        if (len(self._values) + len(self._counters) > limit
+                and len(self._values.keys() | self._counters.keys()) > limit):
+            self._wakeup.set()
+
+    def touch(self, user_id, **values):
+        with self._lock:
+            self._values.setdefault(user_id, {}).update(values)
+            self._pending()
+
+    def count(self, user_id, column, n=1):
+        with self._lock:
+            counters = self._counters.setdefault(user_id, {})
+            counters[column] = counters.get(column, 0) + n
+            self._pending()
+
+    def flush(self):
+        """Write out everything buffered so far; returns the number of users updated."""
+        with self._lock:
+            values, self._values = self._values, {}
+            counters, self._counters = self._counters, {}
+        groups = {}
+        for uid in values.keys() | counters.keys():
+            v, c = values.get(uid, {}), counters.get(uid, {})
+            params = {'b_id': uid}
+            params.update({f'v_{col}': val for col, val in v.items()})
+            params.update({f'n_{col}': n for col, n in c.items()})
+            groups.setdefault((tuple(sorted(v)), tuple(sorted(c))), []).append(params)
+        if not groups:
+            return 0
+        table = User.__table__
+        try:
+            for (set_cols, inc_cols), rows in groups.items():
+                new_values = {col: bindparam(f'v_{col}') for col in set_cols}
+                new_values.update({col: table.c[col] + bindparam(f'n_{col}') for col in inc_cols})
+                db.session.execute(
+                    update(table).where(table.c.id == bindparam('b_id')).values(new_values),
+                    rows,
+                )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            self._restore(values, counters)
+            raise
+        updated = sum(len(rows) for rows in groups.values())
+        self.flushed_total += updated
+        return updated
+
+    def _restore(self, values, counters):
+        """Put a failed flush back, without clobbering values recorded since."""
+        with self._lock:
+            for uid, v in values.items():
+                self._values[uid] = {**v, **self._values.get(uid, {})}
+            for uid, c in counters.items():
+                merged = self._counters.setdefault(uid, {})
+                for col, n in c.items():
+                    merged[col] = merged.get(col, 0) + n
+
+    def _flush_at_exit(self):
+        try:
+            with self.app.app_context():
+                self.flush()
+        except Exception:
+            logger.exception('activity flush at exit failed')
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.app.config['ACTIVITY_FLUSH_SECONDS'])
+            self._wakeup.clear()
+            try:
+                with self.app.app_context():
+                    self.flush()
+            except Exception:
+                logger.exception('activity flush failed')
+
+activity_buffer = ActivityBuffer(app)
+
+class JobCancelled(Exception):
+    pass
+
+class JobAlreadyRunning(Exception):
+    def __init__(self, job_id):
+        super().__init__(f"job {job_id} of this kind is already queued or running")
+        self.job_id = job_id
+
+class JobContext:
+    """Handed to a job function: records progress after every chunk and stops
+    the job (JobCancelled) once a cancel has been requested."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.result = {}
+
+    def _save(self, **values):
+        db.session.execute(
+            update(Job.__table__).where(Job.id == self.job_id).values(heartbeat_at=datetime.utcnow(), **values)
+        )
+        db.session.commit()
+
+    def set_total(self, total):
+        self._save(progress_total=total)
+
+    def advance(self, done, **totals):
+        """Add `done` units of progress and sum `totals` into the job result."""
+        for key, value in totals.items():
+            self.result[key] = self.result.get(key, 0) + value
+        self._save(progress_done=Job.progress_done + done, result=dict(self.result))
+        cancelled = db.session.execute(select(Job.cancel_requested).where(Job.id == self.job_id)).scalar()
+        if cancelled:
+            raise JobCancelled()
+
+JOB_KINDS = {}
+
+def job_kind(name):
+    """Register a job function fn(ctx, **params) under `name`."""
+    def register(fn):
+        JOB_KINDS[name] = fn
+        return fn
+    return register
+
+@job_kind('rollover')
+def rollover_job(ctx, chunk_size=None):
+    today = date.today()
+    ctx.set_total(db.session.execute(select(func.count(User.id)).where(rollover_pending(today))).scalar())
+    for chunk in iter_bulk_rollover(chunk_size, today):
+        ctx.advance(chunk['users'], chunks=1, credited_users=chunk['credited_users'],
+                    credited_mb=chunk['credited_mb'])
+
+@job_kind('cleanup_expired')
+def cleanup_expired_job(ctx, chunk_size=None):
+    now = datetime.utcnow()
+    ctx.set_total(db.session.execute(
+        select(func.count(DataEntry.id)).where(DataEntry.expiry_date < now)
+    ).scalar())
+    for purged in expiry_scheduler.iter_purge_expired(now, chunk_size):
+        ctx.advance(purged, chunks=1, purged=purged)
+
+class JobRunner:
+    """Runs registered job kinds on a small thread pool.
+
+    Job state lives in the job table, so status survives the request that
+    started it and is visible from every worker process; the partial unique
+    index on kind keeps one queued/running job per kind. A job whose heartbeat
+    is older than JOB_STALE_SECONDS (its process died) is marked failed the
+    next time anyone submits or lists jobs.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.app.config['JOB_WORKERS'],
+                                                    thread_name_prefix='job')
+            return self._executor
+
+    def expire_stale(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.app.config['JOB_STALE_SECONDS'])
+        db.session.execute(
+            update(Job.__table__)
+            .where(Job.status.in_(('queued', 'running')),
+                   func.coalesce(Job.heartbeat_at, Job.created_at) < cutoff)
+            .values(status='failed', error='abandoned: no progress within JOB_STALE_SECONDS',
+                    finished_at=datetime.utcnow())
+        )
+        db.session.commit()
+
+    def submit(self, kind, params=None, user_id=None):
+        """Queue a job and return its id; raises JobAlreadyRunning."""
+        if kind not in JOB_KINDS:
+            raise ValueError(f"unknown job kind {kind!r}")
+        self.expire_stale()
+        job = Job(kind=kind, params=params or {}, created_by=user_id, created_at=datetime.utcnow())
+        db.session.add(job)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            active = db.session.execute(
+                select(Job.id).where(Job.kind == kind, Job.status.in_(('queued', 'running')))
+            ).scalar()
+            raise JobAlreadyRunning(active)
+        self._pool().submit(self._run, job.id)
+        return job.id
+
+    def cancel(self, job_id):
+        """Ask a job to stop after its current chunk; a queued job is cancelled at once."""
+        db.session.execute(
+            update(Job.__table__)
+            .where(Job.id == job_id, Job.status == 'queued')
+            .values(status='cancelled', cancel_requested=True, finished_at=datetime.utcnow())
+        )
+        db.session.execute(
+            update(Job.__table__).where(Job.id == job_id, Job.status == 'running').values(cancel_requested=True)
+        )
+        db.session.commit()
+
+    def _finish(self, job_id, **values):
+        db.session.rollback()
+        db.session.execute(
+            update(Job.__table__).where(Job.id == job_id).values(finished_at=datetime.utcnow(), **values)
+        )
+        db.session.commit()
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            started = db.session.execute(
+                update(Job.__table__)
+                .where(Job.id == job_id, Job.status == 'queued')
+                .values(status='running', started_at=datetime.utcnow(), heartbeat_at=datetime.utcnow())
+            ).rowcount
+            db.session.commit()
+            if not started:
+                return
+            job = db.session.get(Job, job_id)
+            ctx = JobContext(job_id)
+            try:
+                JOB_KINDS[job.kind](ctx, **(job.params or {}))
+            except JobCancelled:
+                self._finish(job_id, status='cancelled')
+            except Exception as e:
+                logger.exception('job failed', extra={'fields': {'job_id': job_id, 'kind': job.kind}})
+                self._finish(job_id, status='failed', error=f"{type(e).__name__}: {e}")
+            else:
+                self._finish(job_id, status='done')
+            finally:
+                db.session.remove()
+
+def describe_job(job):
+    """JSON view of a job, with throughput and an ETA while it runs."""
+    end = job.finished_at or datetime.utcnow()
+    elapsed = (end - job.started_at).total_seconds() if job.started_at else 0
+    rate = job.progress_done / elapsed if elapsed > 0 else None
+    remaining = None
+    if rate and job.status == 'running' and job.progress_total is not None:
+        remaining = round(max(job.progress_total - job.progress_done, 0) / rate, 1)
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'params': job.params,
+        'progress': {'done': job.progress_done, 'total': job.progress_total},
+        'result': job.result,
+        'error': job.error,
+        'cancel_requested': job.cancel_requested,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'elapsed_seconds': round(elapsed, 3),
+        'per_second': round(rate, 1) if rate else None,
+        'eta_seconds': remaining,
+        'url': url_for('admin_job', job_id=job.id),
+    }
+
+job_runner = JobRunner(app)
+
+@app.before_request
+def start_background_workers():
+    if app.config['EXPIRY_SCHEDULER_ENABLED']:
+        expiry_scheduler.start()
+    if app.config['ACTIVITY_FLUSH_ENABLED']:
+        activity_buffer.start()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unmatched'
+    seconds = time.perf_counter() - g.pop('request_started', time.perf_counter())
+    statements = g.pop('sql_statements', 0)
+    sql_seconds = g.pop('sql_seconds', 0.0)
+    metrics.inc('bytebank_http_requests_total', endpoint=endpoint, method=request.method,
+                status=response.status_code)
+    metrics.observe('bytebank_http_request_duration_seconds', seconds, endpoint=endpoint)
+    metrics.observe('bytebank_db_statements_per_request', statements, endpoint=endpoint)
+    if statements:
+        metrics.inc('bytebank_db_statements_total', statements, endpoint=endpoint)
+        metrics.inc('bytebank_db_statement_seconds_total', sql_seconds, endpoint=endpoint)
+    response.headers.add('Server-Timing', f'db;desc="{statements} queries";dur={sql_seconds * 1000:.2f}')
+    return response
+
+@metrics.collector
+def collect_component_metrics():
+    caches = {'marketplace': marketplace_cache.stats(), 'fragment': fragment_cache.stats()}
+    return [
+        ('bytebank_cache_hits_total', 'counter', 'Cache hits.',
+         [({'cache': name}, stats['hits']) for name, stats in caches.items()]),
+        ('bytebank_cache_misses_total', 'counter', 'Cache misses.',
+         [({'cache': name}, stats['misses']) for name, stats in caches.items()]),
+        ('bytebank_cache_evictions_total', 'counter', 'Entries evicted for size or count.',
+         [({'cache': name}, stats['evictions']) for name, stats in caches.items()]),
+        ('bytebank_cache_bytes', 'gauge', 'Approximate size of cached values.',
+         [({'cache': name}, stats['bytes']) for name, stats in caches.items()]),
+        ('bytebank_expired_lots_purged_total', 'counter', 'Lots deleted by the expiry scheduler.',
+         [({}, expiry_scheduler.purged_total)]),
+        ('bytebank_activity_rows_flushed_total', 'counter', 'User rows written by the activity buffer.',
+         [({}, activity_buffer.flushed_total)]),
+    ]
+
+@app.route('/metrics')
+def metrics_view():
+    if not app.config['METRICS_ENABLED']:
+        return jsonify({'error': 'not found'}), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.after_request
+def record_activity(response):
+    user_id = session.get('user_id')
+    if user_id and request.endpoint not in (None, 'static'):
+        activity_buffer.touch(user_id, last_seen_at=datetime.utcnow())
+        activity_buffer.count(user_id, 'page_views')
+    return response
 # Routes
 @app.route('/')
 def index():
-    # call helper correctly (was using current_user without parentheses)
-    user = current_user()
+    # header-only page: the session identity is enough
+    user = current_identity()
     main_data = get_all_the_things()
     return render_template('index.html', user=user, main=main_data)
 
@@ -193,16 +2231,17 @@ def register():
         email = request.form['email'].strip().lower()
         password = request.form['password']
 
-        if User.query.filter_by(email=email).first():
-            flash('Email already registered', 'warning')
-            return redirect(url_for('register'))
-
+        # user and wallet in one transaction; the unique email index catches duplicates
         user = User(name=name, email=email)
         user.set_password(password)
         db.session.add(user)
-        db.session.commit()
-        # create wallet
-        ensure_wallet(user)
+        db.session.add(DataWallet(user=user, balance_mb=0, total_purchased_mb=0, total_used_mb=0))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash('Email already registered', 'warning')
+            return redirect(url_for('register'))
         flash('Registration successful. Please log in.', 'success')
         return redirect(url_for('login'))
 
@@ -217,19 +2256,21 @@ def login():
 
         user = User.query.filter_by(email=email).first()
         if user and user.check_password(password):
+            # Upgrade hashes made with an older method or cost
+            if password_service.needs_rehash(user.password_hash):
+                user.set_password(password)
+                db.session.commit()
+
             # Set session info
             session['user_id'] = user.id
-            session['user_name'] = user.name
+            remember_identity(user)
 
-            # Update last login time
-            user.last_login = datetime.utcnow()
+            # Last login time is telemetry; written behind, not in this request
+            activity_buffer.touch(user.id, last_login=datetime.utcnow())
 
             # Ensure wallet exists for the user
             ensure_wallet(user)
 
-            # Save changes to database
-            db.session.commit()
-
             flash('Logged in successfully', 'success')
             return redirect(url_for('dashboard'))
 
@@ -240,110 +2281,91 @@ def login():
     return render_template('login.html')
 @app.route('/logout')
 def logout():
-    session.pop('user_id', None)
+    forget_identity()
     flash('Logged out', 'info')
     return redirect(url_for('index'))
 
 @app.route('/dashboard')
+@read_only
+@conditional_get
 def dashboard():
-    user = current_user()
-    if not user:
+    identity = current_identity()
+    if not identity:
         return redirect(url_for('login'))
 
-    # Apply rollover if needed
-    simulate_end_of_day_rollover(user)
-
-    # Ensure the user has a wallet
-    wallet = ensure_wallet(user)
-
-    # Remove expired data entries
-    cleanup_expired_entries(user)
-
-    # Fetch all active data entries
-    active_entries = get_active_entries(user)
-    total_active_mb = sum(entry.amount_mb for entry in active_entries)
-
-    # Entries expiring in the next 3 days
-    expiring_soon = [
-        entry for entry in active_entries
-        if (entry.expiry_date - datetime.utcnow()).days <= 3
-    ]
-
-    # Calculate remaining daily quota
-    remaining_today = max(user.daily_quota_mb - user.used_today_mb, 0)
-
-    # Summary of total used data
-    total_used_mb = user.used_today_mb
-
-    total_all_time = (user.used_today_mb or 0) + (wallet.total_used_mb or 0)
-
-    return render_template(
-        'dashboard.html',
-        user=user,
-        wallet=wallet,
-        active_entries=active_entries,
-        total_active_mb=total_active_mb,
-        expiring_soon=expiring_soon,
-        remaining_today=remaining_today,
-        total_used_mb=total_used_mb,
-        total_all_time=total_all_time,
-        wallet_balance=wallet.balance_mb
-    )
+    # Read-only: rollover and expiry are applied in the query, never written here
+    data = dashboard_data(identity.id)
+    if data is None:
+        forget_identity()
+        return redirect(url_for('login'))
+    return render_template('dashboard.html', **data)
 
 @app.route('/marketplace')
+@read_only
 def marketplace():
     # 1. Check if user is logged in
-    user_id = session.get('user_id')
-    if not user_id:
+    if not session.get('user_id'):
         flash("Please log in to access the marketplace.")
         return redirect(url_for('login'))
 
-    # 2. Fetch the user from the database
-    user = User.query.get(user_id)
+    # 2. The page only needs header info, which the session identity carries
+    user = current_identity()
     if not user:
         flash("User not found. Please log in again.")
-        session.pop('user_id', None)  # remove invalid session
         return redirect(url_for('login'))
 
-    # 3. Fetch all items safely
-    try:
-        items = DataItem.query.all()  # returns empty list if no items
-    except Exception as e:
-        print(f"Error fetching items: {e}")
-        items = []
+    # 3. One page of search results plus their sellers; the listing markup
+    # does not depend on the viewer, so it is cached next to the rows. Both
+    # are stored under the generation read before the rows were loaded, so
+    # markup of rows from before an invalidation is never cached after it
+    generation = marketplace_cache.generation
+    key, items, sellers, next_cursor = marketplace_page(request.args, generation=generation)
+    listing = marketplace_cache.get_or_set(
+        ('html', key),
+        lambda: Markup(render_template('marketplace_items.html', items=items, sellers=sellers)),
+        size=len,
+        generation=generation,
+    )
+    filters = {k: request.args[k] for k in MARKETPLACE_FILTERS if request.args.get(k)}
 
     # 4. Render the marketplace template
-    return render_template('marketplace.html', user=user, items=items)
+    return render_template(
+        'marketplace.html',
+        user=user,
+        items=items,
+        listing=listing,
+        filters=filters,
+        sorts=MARKETPLACE_SORTS,
+        next_url=url_for('marketplace') + '?' + urlencode(dict(filters, after=next_cursor)) if next_cursor else None,
+        first_url=url_for('marketplace') + ('?' + urlencode(filters) if filters else '') if 'after' in request.args else None
+    )
 
 
 @app.route('/profile')
+@read_only
+@conditional_get
 def profile():
     user = current_user()
     if not user:
         flash("Please login to view your profile.", "error")
         return redirect(url_for('login'))
 
-    # Ensure the user has a wallet
-    wallet = ensure_wallet(user)
+    # Read-only view: show an empty wallet instead of creating one
+    wallet = user.wallet or SimpleNamespace(balance_mb=0, total_purchased_mb=0, total_used_mb=0)
 
     # Calculate total all-time usage
     total_all_time = user.total_used_mb or 0
 
     # Get recent transactions involving the user (sender or receiver)
-    transactions = (
-        Transaction.query.options(
+    transactions = db.session.execute(
+        user_transactions_stmt(user.id, 10).options(
             joinedload(Transaction.sender),
             joinedload(Transaction.receiver)
         )
-        .filter((Transaction.sender_id == user.id) | (Transaction.receiver_id == user.id))
-        .order_by(Transaction.timestamp.desc())
-        .limit(10)
-        .all()
-    )
+    ).scalars().all()
 
-    # Debug prints (optional)
-    print(f"[DEBUG PROFILE] Wallet balance: {wallet.balance_mb}, Wallet used: {wallet.total_used_mb}")
-    print(f"[DEBUG PROFILE] Total All-Time Usage: {total_all_time}")
+    log_event(logging.DEBUG, 'profile_viewed', user_id=user.id, wallet_balance_mb=wallet.balance_mb,
+              wallet_used_mb=wallet.total_used_mb, total_all_time_mb=total_all_time)
 
     return render_template(
         'profile.html',
@@ -362,6 +2384,7 @@ def update_profile():
     if request.method == 'POST':
         user.name = request.form.get('name')
         user.email = request.form.get('email')
+        bump_identity(user)
         db.session.commit()
         flash("Profile updated successfully.", "success")
         return redirect(url_for('profile'))
@@ -381,31 +2404,31 @@ def change_password():
         new_pass = request.form.get('new_password')
         confirm_pass = request.form.get('confirm_password')
 
-        if not check_password_hash(user.password_hash, current_pass):
+        if not user.check_password(current_pass or ''):
             flash("Current password is incorrect.", "error")
         elif new_pass != confirm_pass:
             flash("New passwords do not match.", "error")
         else:
-            user.password = generate_password_hash(new_pass)
+            user.set_password(new_pass)
+            bump_identity(user)
             db.session.commit()
             flash("Password changed successfully.", "success")
             return redirect(url_for('profile'))
 
-    return render_template('change_password.html')
+    return render_template('change_password.html', user=user)
 
 @app.route('/sell', methods=['GET', 'POST'])
 def sell():
-    if 'user_id' not in session:
+    user = current_identity()
+    if not user:
         return redirect(url_for('login'))
 
-    user = User.query.get(session['user_id'])
-
     if request.method == 'POST':
         title = request.form['title']
         description = request.form['description']
         price = float(request.form['price'])
 
-        new_item = DataItem(title=title, description=description, price=price, seller=user)
+        new_item = DataItem(title=title, description=description, price=price, seller_id=user.id)
         db.session.add(new_item)
         db.session.commit()
         flash('Data item listed for sale!', 'success')
@@ -413,17 +2436,15 @@ def sell():
 
     return render_template('sell.html', user=user)
 
-@app.route('/admin/cleanup_expired')
+@app.route('/admin/cleanup_expired', methods=['GET', 'POST'])
 def admin_cleanup_expired():
     user = current_user()
     if not user or not user.is_admin:
         return jsonify({'error':'admin required'}), 403
-    all_entries = DataEntry.query.filter(DataEntry.expiry_date < datetime.utcnow()).all()
-    count = len(all_entries)
-    for e in all_entries:
-        db.session.delete(e)
-    db.session.commit()
-    return jsonify({'cleaned': count})
+    chunk_size = request.args.get('chunk_size', type=int)
+    if chunk_size is not None and chunk_size <= 0:
+        return jsonify({'error': 'chunk_size must be positive'}), 400
+    return start_job('cleanup_expired', {'chunk_size': chunk_size}, user)
 
 @app.route('/buy_data', methods=['GET', 'POST'])
 def buy_data():
@@ -443,32 +2464,12 @@ def buy_data():
         if amount <= 0:
             flash("Amount must be greater than 0.", "danger")
             return redirect(url_for('buy_data'))
+        if not valid_amount(amount):
+            flash("Invalid amount.", "danger")
+            return redirect(url_for('buy_data'))
 
-        # Update wallet balance and total purchased
-        wallet.balance_mb += amount
-        wallet.total_purchased_mb += amount
-
-        # Create new DataEntry so it appears on dashboard
-        expiry_date = datetime.utcnow() + timedelta(days=30)  # purchased data valid for 30 days
-        new_entry = DataEntry(
-            user_id=user.id,
-            amount_mb=amount,
-            source='purchased',
-            added_on=datetime.utcnow(),
-            expiry_date=expiry_date
-        )
-        db.session.add(new_entry)
-
-        # Add transaction record
-        txn = Transaction(
-            sender_id=None,
-            receiver_id=user.id,
-            amount_mb=amount,
-            note=f"Bought {amount} MB of data"
-        )
-        db.session.add(txn)
-
-        db.session.commit()
+        # Balance, purchase total, 30-day lot and history row in one transaction
+        ledger_purchase(user.id, amount)
 
         flash(f"Successfully bought {amount} MB of data!", "success")
         return redirect(url_for('dashboard'))
@@ -481,6 +2482,9 @@ def use_data():
     if not user:
         return redirect(url_for('login'))
 
+    # Materialise a pending day rollover before checking today's quota
+    simulate_end_of_day_rollover(user)
+
     wallet = ensure_wallet(user)
 
     try:
@@ -499,41 +2503,17 @@ def use_data():
         used_amount = 0  # Track actual amount used
 
         if source == 'daily':
-            quota_left = (user.daily_quota_mb or 0) - (user.used_today_mb or 0)
-            if amount > quota_left:
+            if not use_daily_quota(user.id, amount):
                 flash("Not enough daily quota remaining.", "danger")
                 return redirect(url_for('dashboard'))
-
-            user.used_today_mb += amount
-            user.total_used_mb = (user.total_used_mb or 0) + amount
             used_amount = amount
             flash(f"Used {amount} MB from daily quota.", "success")
 
         elif source == 'wallet':
-            if wallet.balance_mb < amount:
+            # Debit, burn soonest-expiring lots first and count usage atomically
+            if not use_wallet_data(user.id, amount):
                 flash("Not enough balance in wallet.", "danger")
                 return redirect(url_for('dashboard'))
-
-            # Consume active DataEntry records safely
-            active_entries = get_active_entries(user) or []
-            remaining = amount
-
-            for entry in active_entries[:]:  # iterate over a copy to safely delete
-                if remaining <= 0:
-                    break
-                entry_amount = entry.amount_mb or 0
-                if entry_amount <= remaining:
-                    remaining -= entry_amount
-                    entry.amount_mb = 0
-                    db.session.delete(entry)  # remove fully consumed entry
-                else:
-                    entry.amount_mb -= remaining
-                    remaining = 0
-
-            # Update wallet and all-time usage
-            wallet.balance_mb -= amount
-            wallet.total_used_mb = (wallet.total_used_mb or 0) + amount
-            user.total_used_mb = (user.total_used_mb or 0) + amount
             used_amount = amount
             flash(f"Used {amount} MB from wallet balance.", "success")
 
@@ -549,10 +2529,9 @@ def use_data():
         wallet = ensure_wallet(user)
         active_entries = get_active_entries(user) or []
 
-        # Debug prints
-        print(f"[DEBUG] Wallet balance: {wallet.balance_mb}, Total used: {wallet.total_used_mb}")
-        print(f"[DEBUG] User daily used: {user.used_today_mb}")
-        print(f"[DEBUG] Active entries count: {len(active_entries)}")
+        log_event(logging.DEBUG, 'data_used', user_id=user.id, source=source, amount_mb=used_amount,
+                  wallet_balance_mb=wallet.balance_mb, wallet_used_mb=wallet.total_used_mb,
+                  used_today_mb=user.used_today_mb, active_entries=len(active_entries))
 
         # Calculate total all-time usage
         total_all_time = user.total_used_mb or 0
@@ -572,8 +2551,7 @@ def use_data():
 
     except Exception as e:
         db.session.rollback()
-        import traceback
-        traceback.print_exc()  # prints full error stack trace
+        logger.exception('use_data failed', extra={'fields': {'user_id': user.id}})
         flash(f"An error occurred: {str(e)}", "danger")
         return redirect(url_for('dashboard'))
 
@@ -596,57 +2574,385 @@ def transfer():
             flash('Enter a valid amount', 'warning')
             return redirect(url_for('transfer'))
 
-        if wallet.balance_mb < amount_mb:
+        if not valid_amount(amount_mb):
             flash('Insufficient wallet balance', 'danger')
             return redirect(url_for('transfer'))
 
-        receiver = User.query.filter_by(email=to_email).first()
-        if not receiver:
+        receiver_id = db.session.execute(
+            select(User.id).where(User.email == to_email)
+        ).scalar()
+        if receiver_id is None:
             flash('Recipient not found', 'warning')
             return redirect(url_for('transfer'))
 
-        # perform transfer
-        wallet.balance_mb -= amount_mb
-        recv_wallet = ensure_wallet(receiver)
-        recv_wallet.balance_mb += amount_mb
-
-        txn = Transaction(sender_id=user.id, receiver_id=receiver.id, amount_mb=amount_mb, note='Transfer')
-        db.session.add(txn)
-        db.session.commit()
-        flash(f'Transferred {amount_mb} MB to {receiver.email}', 'success')
+        # perform transfer: debit, credit and history row in one transaction
+        if not ledger_transfer(user.id, receiver_id, amount_mb):
+            flash('Insufficient wallet balance', 'danger')
+            return redirect(url_for('transfer'))
+        flash(f'Transferred {amount_mb} MB to {to_email}', 'success')
         return redirect(url_for('dashboard'))
 
     return render_template('transfer.html', user=user, wallet=wallet)
 
+@app.route('/transfer/batch', methods=['POST'])
+def transfer_batch():
+    """JSON body: {"transfers": [{"email": ..., "amount_mb": ...}, ...]}"""
+    user = current_user()
+    if not user:
+        return jsonify({'error': 'login required'}), 401
+    payload = request.get_json(silent=True) or {}
+    transfers = payload.get('transfers')
+    if not isinstance(transfers, list) or not transfers:
+        return jsonify({'error': 'transfers must be a non-empty list'}), 400
+    if len(transfers) > app.config['BATCH_TRANSFER_MAX_ITEMS']:
+        return jsonify({'error': f"at most {app.config['BATCH_TRANSFER_MAX_ITEMS']} transfers per batch"}), 400
+
+    note = (payload.get('note') if isinstance(payload.get('note'), str) else None) or 'Batch transfer'
+
+    items = [(t.get('email'), t.get('amount_mb')) if isinstance(t, dict) else (None, None) for t in transfers]
+    simulate_end_of_day_rollover(user)
+    applied, results = ledger_batch_transfer(user.id, items, note=note[:250])
+    debited = sum(r['amount_mb'] for r in results if r['status'] == 'ok') if applied else 0
+    status = 200 if applied else 400
+    return jsonify({'applied': applied, 'debited_mb': debited, 'results': results}), status
+
 @app.route('/transactions')
+@read_only
+@conditional_get
 def transactions():
     user = current_user()
     if not user:
         return redirect(url_for('login'))
-    txns = Transaction.query.filter(
-        (Transaction.sender_id == user.id) | (Transaction.receiver_id == user.id)
-    ).order_by(Transaction.timestamp.desc()).limit(200).all()
-    return render_template('transactions.html', user=user, txns=txns)
+    txns, next_cursor = transaction_page(
+        lambda limit, before: user_transactions_stmt(user.id, limit, before)
+    )
+    return render_template(
+        'transactions.html',
+        user=user,
+        txns=txns,
+        emails=counterparty_emails(txns),
+        next_cursor=next_cursor,
+        is_first_page='before' not in request.args
+    )
+
+@app.route('/transactions/export')
+@read_only
+def transactions_export():
+    user = current_user()
+    if not user:
+        return redirect(url_for('login'))
+    user_id = user.id
+    return export_response(
+        lambda limit, before: user_transactions_stmt(user_id, limit, before),
+        f"transactions-user{user_id}"
+    )
+
+@app.route('/admin/transactions/export')
+@read_only
+def admin_transactions_export():
+    user = current_user()
+    if not user or not user.is_admin:
+        return jsonify({'error': 'admin required'}), 403
+    return export_response(recent_transactions_stmt, 'transactions-all')
 
 @app.route('/admin')
+@read_only
 def admin_panel():
     user = current_user()
     if not user or not user.is_admin:
         flash('Admin access required', 'danger')
         return redirect(url_for('index'))
-    users = User.query.all()
-    txns = Transaction.query.order_by(Transaction.timestamp.desc()).limit(200).all()
-    return render_template('admin.html', user=user, users=users, txns=txns)
+    users, page, has_next = admin_user_rows(request.args)
+    page_args = {k: request.args[k] for k in ADMIN_USER_FILTERS if request.args.get(k)}
+
+    def users_url(to_page):
+        return url_for('admin_panel') + '?' + urlencode(dict(page_args, page=to_page))
+
+    txns, next_cursor = transaction_page(recent_transactions_stmt)
+    # Fragment cache version of the user table: versions only grow, so any
+    # wallet/usage or profile change moves the sum; a new login moves the max
+    users_version = (
+        sum(u.data_version + u.session_version for u in users),
+        max((u.last_login for u in users if u.last_login), default=None),
+    )
+    return render_template(
+        'admin.html',
+        user=user,
+        users=users,
+        users_version=users_version,
+        sort_columns=ADMIN_USER_COLUMNS,
+        filters=page_args,
+        prev_users_url=users_url(page - 1) if page > 1 else None,
+        next_users_url=users_url(page + 1) if has_next else None,
+        txns=txns,
+        emails=counterparty_emails(txns),
+        next_cursor=next_cursor,
+        is_first_page='before' not in request.args
+    )
 
-@app.route('/admin/simulate_rollover_all')
+@app.route('/admin/cache_stats')
+def admin_cache_stats():
+    user = current_user()
+    if not user or not user.is_admin:
+        return jsonify({'error': 'admin required'}), 403
+    return jsonify({'marketplace': marketplace_cache.stats(), 'fragments': fragment_cache.stats()})
+
+@app.route('/admin/template_stats')
+def admin_template_stats():
+    user = current_user()
+    if not user or not user.is_admin:
+        return jsonify({'error': 'admin required'}), 403
+    return jsonify(template_timings.stats())
+
+@app.route('/admin/simulate_rollover_all', methods=['GET', 'POST'])
 def admin_simulate_rollover_all():
     user = current_user()
     if not user or not user.is_admin:
         return jsonify({'error': 'admin required'}), 403
-    all_users = User.query.all()
-    for u in all_users:
-        simulate_end_of_day_rollover(u)
-    return jsonify({'status':'ok', 'rolled_over_users': len(all_users)})
+    chunk_size = request.args.get('chunk_size', type=int)
+    if chunk_size is not None and chunk_size <= 0:
+        return jsonify({'error': 'chunk_size must be positive'}), 400
+    return start_job('rollover', {'chunk_size': chunk_size}, user)
+
+def start_job(kind, params, user):
+    """Queue an admin job; 202 with its status URL, or 409 if one is already active."""
+    try:
+        job_id = job_runner.submit(kind, params, user_id=user.id)
+    except JobAlreadyRunning as e:
+        return jsonify({'error': str(e), 'job': url_for('admin_job', job_id=e.job_id)}), 409
+    response = jsonify(describe_job(db.session.get(Job, job_id)))
+    response.status_code = 202
+    response.headers['Location'] = url_for('admin_job', job_id=job_id)
+    return response
+
+@app.route('/admin/jobs')
+def admin_jobs():
+    user = current_user()
+    if not user or not user.is_admin:
+        return jsonify({'error': 'admin required'}), 403
+    job_runner.expire_stale()
+    jobs = db.session.execute(
+        select(Job).order_by(Job.created_at.desc(), Job.id.desc()).limit(50)
+    ).scalars().all()
+    return jsonify({'jobs': [describe_job(job) for job in jobs], 'kinds': sorted(JOB_KINDS)})
+
+@app.route('/admin/jobs/<int:job_id>')
+def admin_job(job_id):
+    user = current_user()
+    if not user or not user.is_admin:
+        return jsonify({'error': 'admin required'}), 403
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify({'error': 'no such job'}), 404
+    return jsonify(describe_job(job))
+
+@app.route('/admin/jobs/<int:job_id>/cancel', methods=['POST'])
+def admin_job_cancel(job_id):
+    user = current_user()
+    if not user or not user.is_admin:
+        return jsonify({'error': 'admin required'}), 403
+    if db.session.get(Job, job_id) is None:
+        return jsonify({'error': 'no such job'}), 404
+    job_runner.cancel(job_id)
+    return jsonify(describe_job(db.session.get(Job, job_id))), 202
+
+@app.errorhandler(PasswordServiceBusy)
+def password_service_busy(e):
+    db.session.rollback()
+    flash('The server is busy, please try again in a moment.', 'warning')
+    return redirect(request.path), 303
+
+# JSON API v1
+#
+# Session-authenticated like the HTML routes. Collections are columnar
+# ({"fields": [...], "rows": [[...], ...]}) so keys are not repeated per row;
+# ?fields=a,b (or fields[<resource>]=a,b in /api/v1/batch) trims both the
+# payload and, where a field needs an extra query, the work done.
+API_WALLET_FIELDS = ('balance_mb', 'total_purchased_mb', 'wallet_used_mb', 'daily_quota_mb',
+                     'used_today_mb', 'remaining_today_mb', 'active_mb')
+API_ENTRY_FIELDS = ('id', 'amount_mb', 'source', 'added_on', 'expiry_date')
+API_TRANSACTION_FIELDS = ('id', 'timestamp', 'direction', 'amount_mb', 'note',
+                          'sender_id', 'receiver_id', 'counterparty')
+API_DEFAULT_FIELDS = {
+    'wallet': API_WALLET_FIELDS,
+    'entries': API_ENTRY_FIELDS,
+    'transactions': ('id', 'timestamp', 'direction', 'amount_mb', 'note'),
+}
+API_ALL_FIELDS = {'wallet': API_WALLET_FIELDS, 'entries': API_ENTRY_FIELDS, 'transactions': API_TRANSACTION_FIELDS}
+
+class APIError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+@app.errorhandler(APIError)
+def api_error(e):
+    return jsonify({'error': str(e)}), e.status
+
+def api_user_id():
+    user_id = session.get('user_id')
+    if not user_id:
+        raise APIError('login required', 401)
+    return user_id
+
+def api_fields(resource, single=True):
+    """Requested fields of a resource, in canonical order."""
+    raw = request.args.get(f'fields[{resource}]') or (request.args.get('fields') if single else None)
+    if not raw:
+        return API_DEFAULT_FIELDS[resource]
+    wanted = {f.strip() for f in raw.split(',') if f.strip()}
+    unknown = wanted - set(API_ALL_FIELDS[resource])
+    if unknown:
+        raise APIError(f"unknown {resource} fields: {', '.join(sorted(unknown))}")
+    return tuple(f for f in API_ALL_FIELDS[resource] if f in wanted)
+
+def api_value(value):
+    return value.isoformat(timespec='seconds') if isinstance(value, (datetime, date)) else value
+
+def api_wallet(data, fields):
+    wallet, user = data['wallet'], data['user']
+    values = {
+        'balance_mb': wallet.balance_mb,
+        'total_purchased_mb': wallet.total_purchased_mb,
+        'wallet_used_mb': wallet.total_used_mb,
+        'daily_quota_mb': user.daily_quota_mb,
+        'used_today_mb': user.used_today_mb,
+        'remaining_today_mb': data['remaining_today'],
+        'active_mb': data['total_active_mb'],
+    }
+    return {f: values[f] for f in fields}
+
+def api_entries(data, fields):
+    return {'fields': fields,
+            'rows': [[api_value(getattr(e, f)) for f in fields] for e in data['active_entries']]}
+
+def api_transactions(user_id, fields):
+    limit = min(request.args.get('limit', app.config['TRANSACTIONS_PAGE_SIZE'], type=int) or 1,
+                app.config['API_MAX_PAGE_SIZE'])
+    txns, next_cursor = transaction_page(
+        lambda limit, before: user_transactions_stmt(user_id, limit, before), page_size=max(limit, 1)
+    )
+    emails = {}
+    if 'counterparty' in fields:
+        emails = counterparty_emails(txns)
+    rows = []
+    for t in txns:
+        outgoing = t.sender_id == user_id
+        values = {
+            'id': t.id, 'timestamp': api_value(t.timestamp), 'direction': 'out' if outgoing else 'in',
+            'amount_mb': t.amount_mb, 'note': t.note, 'sender_id': t.sender_id, 'receiver_id': t.receiver_id,
+            'counterparty': emails.get(t.receiver_id if outgoing else t.sender_id),
+        }
+        rows.append([values[f] for f in fields])
+    return {'fields': fields, 'rows': rows, 'next': next_cursor}
+
+def api_dashboard(user_id):
+    data = dashboard_data(user_id)
+    if data is None:
+        forget_identity()
+        raise APIError('login required', 401)
+    return data
+
+def api_amount(payload, key='amount_mb'):
+    amount = payload.get(key)
+    if not isinstance(amount, int) or isinstance(amount, bool) or not valid_amount(amount):
+        raise APIError(f"{key} must be a positive integer of at most {app.config['MAX_AMOUNT_MB']}")
+    return amount
+
+def api_payload():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        raise APIError('expected a JSON object body')
+    return payload
+
+@app.route('/api/v1/wallet')
+@read_only
+@conditional_get(flashes=False)
+def api_v1_wallet():
+    user_id = api_user_id()
+    return jsonify(api_wallet(api_dashboard(user_id), api_fields('wallet')))
+
+@app.route('/api/v1/entries')
+@read_only
+@conditional_get(flashes=False)
+def api_v1_entries():
+    user_id = api_user_id()
+    return jsonify(api_entries(api_dashboard(user_id), api_fields('entries')))
+
+@app.route('/api/v1/transactions')
+@read_only
+@conditional_get(flashes=False)
+def api_v1_transactions():
+    user_id = api_user_id()
+    return jsonify(api_transactions(user_id, api_fields('transactions')))
+
+@app.route('/api/v1/batch')
+@read_only
+@conditional_get(flashes=False)
+def api_v1_batch():
+    """?include=wallet,entries,transactions in one response; wallet and entries
+    share a single dashboard query."""
+    user_id = api_user_id()
+    include = [r.strip() for r in request.args.get('include', 'wallet').split(',') if r.strip()]
+    unknown = set(include) - set(API_DEFAULT_FIELDS)
+    if unknown:
+        raise APIError(f"unknown resources: {', '.join(sorted(unknown))}")
+    body = {}
+    data = api_dashboard(user_id) if {'wallet', 'entries'} & set(include) else None
+    if 'wallet' in include:
+        body['wallet'] = api_wallet(data, api_fields('wallet', single=False))
+    if 'entries' in include:
+        body['entries'] = api_entries(data, api_fields('entries', single=False))
+    if 'transactions' in include:
+        body['transactions'] = api_transactions(user_id, api_fields('transactions', single=False))
+    return jsonify(body)
+
+@app.route('/api/v1/usage', methods=['POST'])
+def api_v1_usage():
+    """{"amount_mb": n, "source": "daily" | "wallet"}"""
+    user_id = api_user_id()
+    payload = api_payload()
+    amount = api_amount(payload)
+    source = payload.get('source')
+    if source not in ('daily', 'wallet'):
+        raise APIError("source must be 'daily' or 'wallet'")
+    # Materialise the rollover api_wallet already reports before spending from it
+    simulate_end_of_day_rollover(db.session.get(User, user_id))
+    if source == 'daily':
+        ok = use_daily_quota(user_id, amount)
+        if ok:
+            db.session.commit()
+        else:
+            db.session.rollback()
+    else:
+        ok = use_wallet_data(user_id, amount)
+    if not ok:
+        raise APIError('not enough daily quota' if source == 'daily' else 'insufficient wallet balance', 409)
+    return jsonify({'used_mb': amount, 'wallet': api_wallet(api_dashboard(user_id), API_WALLET_FIELDS)})
+
+@app.route('/api/v1/buy', methods=['POST'])
+def api_v1_buy():
+    """{"amount_mb": n}"""
+    user_id = api_user_id()
+    amount = api_amount(api_payload())
+    ledger_purchase(user_id, amount)
+    return jsonify({'bought_mb': amount, 'wallet': api_wallet(api_dashboard(user_id), API_WALLET_FIELDS)})
+
+@app.route('/api/v1/transfer', methods=['POST'])
+def api_v1_transfer():
+    """{"to_email": ..., "amount_mb": n, "note": optional}; /transfer/batch pays many at once."""
+    user_id = api_user_id()
+    payload = api_payload()
+    amount = api_amount(payload)
+    to_email = (payload.get('to_email') or '').strip().lower() if isinstance(payload.get('to_email'), str) else ''
+    receiver_id = db.session.execute(select(User.id).where(User.email == to_email)).scalar() if to_email else None
+    if receiver_id is None:
+        raise APIError('recipient not found', 404)
+    note = payload.get('note') if isinstance(payload.get('note'), str) else 'Transfer'
+    simulate_end_of_day_rollover(db.session.get(User, user_id))
+    if not ledger_transfer(user_id, receiver_id, amount, note=note[:250]):
+        raise APIError('insufficient wallet balance', 409)
+    return jsonify({'sent_mb': amount, 'wallet': api_wallet(api_dashboard(user_id), API_WALLET_FIELDS)})
 
 # Utilities
 @app.template_filter('mb_to_gb')
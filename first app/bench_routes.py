@@ -0,0 +1,307 @@
+"""Load-test the real routes against a synthetic database and compare to a baseline.
+
+A scratch SQLite database is filled with --users users, --lots DataEntry lots,
+--txns Transaction rows and --items marketplace listings. Activity is skewed:
+users are ranked and picked with Zipf weights, so a few heavy users own most
+lots and history, as in production. The app is then served by a threaded
+local WSGI server and --clients logged-in clients drive a weighted mix of
+/dashboard, /use_data, /transfer, /transactions, /admin and /marketplace for
+--seconds. Per route it reports throughput, p50/p99 latency and SQL
+statements per request (from the db Server-Timing entry).
+
+--save writes the results as a baseline; later runs compare against it and
+exit non-zero when a route's p99 grows past --tolerance or it issues more
+queries per request.
+
+    python bench_routes.py --users 5000 --lots 50000 --txns 200000 --save
+    python bench_routes.py --users 5000 --lots 50000 --txns 200000
+"""
+import argparse
+import bisect
+import http.client
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from itertools import accumulate, islice
+from urllib.parse import urlencode
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--users', type=int, default=2000)
+parser.add_argument('--lots', type=int, default=20000, help='DataEntry rows')
+parser.add_argument('--txns', type=int, default=50000, help='Transaction rows')
+parser.add_argument('--items', type=int, default=2000, help='marketplace listings')
+parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent for user activity')
+parser.add_argument('--clients', type=int, default=8, help='concurrent logged-in clients')
+parser.add_argument('--seconds', type=float, default=10)
+parser.add_argument('--warmup', type=float, default=2, help='seconds of load before measuring')
+parser.add_argument('--seed', type=int, default=1)
+parser.add_argument('--baseline', help='default: bench_baseline.json in the instance folder')
+parser.add_argument('--save', action='store_true', help='store this run as the baseline')
+parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p99 growth over the baseline')
+args = parser.parse_args()
+
+# Point the app at a scratch database before it is imported
+# (a directory, so SQLite's -wal/-shm files go with it)
+scratch = tempfile.TemporaryDirectory(prefix='bytebank-bench-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(scratch.name, 'bench.db')
+
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import make_server
+
+from app import app, db, activity_buffer, User, DataWallet, DataEntry, DataItem, Transaction
+
+app.config['EXPIRY_SCHEDULER_ENABLED'] = False
+# Logins are not what is measured; a cheap hash keeps client setup quick
+app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+
+PASSWORD = 'bench'
+CHUNK_SIZE = 5000
+
+# route -> (weight in the mix, request builder); builders return (method, path, form)
+ROUTES = {
+    'dashboard': (30, lambda rng, pick: ('GET', '/dashboard', None)),
+    'use_data': (10, lambda rng, pick: ('POST', '/use_data', {
+        'amount_mb': rng.randint(1, 20), 'source': rng.choice(['wallet', 'daily'])})),
+    'transfer': (10, lambda rng, pick: ('POST', '/transfer', {
+        'to_email': f'user{pick()}@bench.local', 'amount_mb': rng.randint(1, 20)})),
+    'transactions': (20, lambda rng, pick: ('GET', '/transactions', None)),
+    'admin': (5, lambda rng, pick: ('GET', '/admin?' + urlencode(rng.choice([
+        {}, {'sort': 'usage', 'order': 'desc'}, {'email': f'user{rng.randint(1, 99)}'}])), None)),
+    'marketplace': (25, lambda rng, pick: ('GET', '/marketplace?' + urlencode(rng.choice([
+        {}, {'sort': 'price_asc'}, {'q': rng.choice(['fast', 'monthly', 'pack'])},
+        {'min_price': rng.randint(0, 50), 'max_price': rng.randint(50, 100)}])), None)),
+}
+
+
+def zipf_picker(n, skew, rng):
+    """Returns pick() -> user id in 1..n, where id 1 is the most active."""
+    cum = list(accumulate(1 / rank ** skew for rank in range(1, n + 1)))
+    total = cum[-1]
+    return lambda: bisect.bisect_left(cum, rng.random() * total) + 1
+
+
+def chunked(rows, size=CHUNK_SIZE):
+    it = iter(rows)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+
+def generate(rng):
+    """Fill the scratch database; wallet balances match each user's active lots."""
+    pick = zipf_picker(args.users, args.skew, rng)
+    now = datetime.utcnow()
+    password_hash = generate_password_hash(PASSWORD, method=app.config['PASSWORD_HASH_METHOD'])
+    with app.app_context():
+        db.create_all()
+        db.session.execute(insert(User.__table__), [
+            {'id': i, 'name': f'User {i}', 'email': f'user{i}@bench.local', 'password_hash': password_hash,
+             'daily_quota_mb': 1024, 'used_today_mb': rng.randint(0, 512), 'total_used_mb': 0,
+             'last_usage_date': now.date(), 'is_admin': i == 1, 'created_at': now - timedelta(days=365),
+             'last_login': now - timedelta(minutes=rng.randint(0, 60 * 24 * 30)), 'session_version': 0}
+            for i in range(1, args.users + 1)
+        ])
+
+        balances = defaultdict(int)
+        lots = []
+        for _ in range(args.lots):
+            uid = pick()
+            amount = rng.choice([100, 250, 500, 1024])
+            added = now - timedelta(days=rng.randint(0, 40))
+            expiry = added + timedelta(days=30)
+            if expiry > now:
+                balances[uid] += amount
+            lots.append({'user_id': uid, 'amount_mb': amount, 'source': rng.choice(['earned', 'purchased']),
+                         'added_on': added, 'expiry_date': expiry})
+        for chunk in chunked(lots):
+            db.session.execute(insert(DataEntry.__table__), chunk)
+        db.session.execute(insert(DataWallet.__table__), [
+            {'user_id': i, 'balance_mb': balances[i], 'total_purchased_mb': balances[i], 'total_used_mb': 0,
+             'created_at': now, 'updated_at': now}
+            for i in range(1, args.users + 1)
+        ])
+
+        def txn():
+            receiver = pick()
+            sender = pick() if rng.random() < 0.7 else None
+            amount = rng.randint(1, 500)
+            return {'sender_id': sender, 'receiver_id': receiver, 'amount_mb': amount,
+                    'timestamp': now - timedelta(seconds=rng.randint(0, 86400 * 90)),
+                    'note': 'Transfer' if sender else f'Bought {amount} MB of data'}
+        for chunk in chunked(txn() for _ in range(args.txns)):
+            db.session.execute(insert(Transaction.__table__), chunk)
+
+        words = ['fast', 'monthly', 'weekend', 'night', 'roaming', 'unused']
+        for chunk in chunked({'title': f'{rng.choice(words)} data pack {i}',
+                              'description': f'{rng.choice(words)} {rng.choice(words)} bundle',
+                              'price': round(rng.uniform(0.5, 100), 2), 'seller_id': pick()}
+                             for i in range(args.items)):
+            db.session.execute(insert(DataItem.__table__), chunk)
+        db.session.commit()
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+    return pick
+
+
+class Client:
+    """One logged-in browser: a keep-alive connection plus the session cookie."""
+
+    def __init__(self, port, email):
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        self.cookies = {}
+        status, _ = self.request('POST', '/login', {'email': email, 'password': PASSWORD})
+        if status != 302 or 'session' not in self.cookies:
+            raise RuntimeError(f'login as {email} failed with {status}')
+
+    def request(self, method, path, form=None):
+        """Returns (status, SQL statements reported by the app)."""
+        headers = {'Cookie': '; '.join(f'{k}={v}' for k, v in self.cookies.items())}
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        self.conn.request(method, path, body=body, headers=headers)
+        response = self.conn.getresponse()
+        response.read()
+        for header in response.headers.get_all('Set-Cookie') or ():
+            name, _, value = header.split(';', 1)[0].partition('=')
+            self.cookies[name] = value
+        m = re.search(r'db;desc="(\d+) queries"', response.headers.get('Server-Timing', ''))
+        return response.status, int(m.group(1)) if m else 0
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def drive(port, pick, seed, measuring, stop, samples, lock):
+    rng = random.Random(seed)
+    uid = pick()
+    user = Client(port, f'user{uid}@bench.local')
+    admin = Client(port, 'user1@bench.local')
+    names = list(ROUTES)
+    weights = [ROUTES[name][0] for name in names]
+    local = defaultdict(list)  # route -> [(seconds, statements, ok)]
+    while not stop.is_set():
+        name = rng.choices(names, weights)[0]
+        method, path, form = ROUTES[name][1](rng, pick)
+        client = admin if name == 'admin' else user
+        started = time.perf_counter()
+        status, statements = client.request(method, path, form)
+        elapsed = time.perf_counter() - started
+        if measuring.is_set():
+            local[name].append((elapsed, statements, status < 400))
+    with lock:
+        for name, rows in local.items():
+            samples[name].extend(rows)
+
+
+def summarize(samples, seconds):
+    results = {}
+    for name in ROUTES:
+        rows = samples.get(name, [])
+        latencies = sorted(r[0] for r in rows)
+        results[name] = {
+            'requests': len(rows),
+            'rps': len(rows) / seconds,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'queries': sum(r[1] for r in rows) / len(rows) if rows else 0.0,
+            'errors': sum(not r[2] for r in rows),
+        }
+    return results
+
+
+def compare(results, baseline):
+    """Lines describing every route that got slower or chattier than the baseline."""
+    regressions = []
+    for name, now in results.items():
+        before = baseline['routes'].get(name)
+        if not before or not now['requests']:
+            continue
+        if now['p99_ms'] > before['p99_ms'] * (1 + args.tolerance):
+            regressions.append(f"{name}: p99 {before['p99_ms']:.1f} -> {now['p99_ms']:.1f} ms")
+        if now['queries'] > before['queries'] + 0.5:
+            regressions.append(f"{name}: queries/request {before['queries']:.1f} -> {now['queries']:.1f}")
+    return regressions
+
+
+def main():
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    pick = generate(rng)
+    print(f"Generated {args.users} users, {args.lots} lots, {args.txns} transactions, "
+          f"{args.items} listings in {time.perf_counter() - started:.1f}s")
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # no access log per request
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    measuring, stop = threading.Event(), threading.Event()
+    samples, lock = defaultdict(list), threading.Lock()
+    threads = [threading.Thread(target=drive, args=(server.server_port, pick, args.seed * 1000 + i,
+                                                     measuring, stop, samples, lock))
+               for i in range(args.clients)]
+    for t in threads:
+        t.start()
+    try:
+        time.sleep(args.warmup)
+        measuring.set()
+        time.sleep(args.seconds)
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+        server.shutdown()
+
+    results = summarize(samples, args.seconds)
+    total = sum(r['requests'] for r in results.values())
+    print(f"{args.clients} clients, {args.seconds:g}s: {total / args.seconds:.0f} requests/s")
+    print(f"{'route':<14}{'req/s':>8}{'p50 ms':>9}{'p99 ms':>9}{'queries':>9}{'errors':>8}")
+    for name, r in results.items():
+        print(f"{name:<14}{r['rps']:>8.1f}{r['p50_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['queries']:>9.1f}{r['errors']:>8}")
+
+    baseline_path = args.baseline or os.path.join(app.instance_path, 'bench_baseline.json')
+    run = {'params': {k: getattr(args, k) for k in ('users', 'lots', 'txns', 'items', 'skew', 'clients')},
+           'created_at': datetime.utcnow().isoformat(timespec='seconds'), 'routes': results}
+    status = 0
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(baseline_path)), exist_ok=True)
+        with open(baseline_path, 'w') as f:
+            json.dump(run, f, indent=2)
+        print(f"Saved baseline to {baseline_path}")
+    elif os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if baseline['params'] != run['params']:
+            print(f"Baseline was recorded with {baseline['params']}; comparison may not be meaningful")
+        regressions = compare(results, baseline)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if not regressions:
+            print(f"No regressions against baseline from {baseline['created_at']}")
+        status = 1 if regressions else 0
+    if any(r['errors'] for r in results.values()):
+        print("Some requests failed; see the errors column")
+        status = 1
+    return status
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    finally:
+        with app.app_context():
+            activity_buffer.flush()  # before the database goes, not at exit
+            db.engine.dispose()
+        scratch.cleanup()
@@ -0,0 +1,118 @@
+"""Compare concurrent read/write throughput across the SQLite engine profiles.
+
+For every profile in app.SQLITE_PROFILES a fresh scratch database is seeded
+and hammered for --seconds by reader threads (the /dashboard query) and
+writer threads (wallet transfers). Each profile runs in its own process,
+because the engine is configured when the app is imported.
+
+    python bench_sqlite_profiles.py --readers 8 --writers 2 --seconds 5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+def run_profile(args):
+    """Child process: benchmark the profile selected through SQLITE_PROFILE."""
+    import random
+    from datetime import datetime, timedelta
+
+    from sqlalchemy import insert
+    from sqlalchemy.exc import OperationalError
+
+    from app import app, db, User, DataWallet, DataEntry, dashboard_data, ledger_transfer
+
+    app.config['EXPIRY_SCHEDULER_ENABLED'] = False
+    with app.app_context():
+        db.create_all()
+        db.session.execute(insert(User.__table__), [
+            {'id': i, 'name': f'bench{i}', 'email': f'bench{i}@bench.local', 'password_hash': 'x'}
+            for i in range(1, args.users + 1)
+        ])
+        db.session.execute(insert(DataWallet.__table__), [
+            {'user_id': i, 'balance_mb': 10 ** 6, 'total_purchased_mb': 0, 'total_used_mb': 0}
+            for i in range(1, args.users + 1)
+        ])
+        now = datetime.utcnow()
+        db.session.execute(insert(DataEntry.__table__), [
+            {'user_id': i, 'amount_mb': 100, 'source': 'earned', 'added_on': now,
+             'expiry_date': now + timedelta(days=k + 1)}
+            for i in range(1, args.users + 1) for k in range(5)
+        ])
+        db.session.commit()
+
+    stop = threading.Event()
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def loop(kind, seed):
+        rng = random.Random(seed)
+        done = errors = 0
+        with app.app_context():
+            while not stop.is_set():
+                try:
+                    if kind == 'reads':
+                        dashboard_data(rng.randint(1, args.users))
+                        db.session.rollback()
+                    else:
+                        ledger_transfer(rng.randint(1, args.users), rng.randint(1, args.users), 1, note='Bench')
+                    done += 1
+                except OperationalError:
+                    db.session.rollback()
+                    errors += 1
+            db.session.remove()
+        with lock:
+            counts[kind] += done
+            counts['errors'] += errors
+
+    threads = [threading.Thread(target=loop, args=('reads', i)) for i in range(args.readers)]
+    threads += [threading.Thread(target=loop, args=('writes', 100 + i)) for i in range(args.writers)]
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    print(json.dumps({k: v / args.seconds if k != 'errors' else v for k, v in counts.items()}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--profiles', nargs='*', help='default: all profiles')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_profile(args)
+        return 0
+
+    from app import SQLITE_PROFILES
+    profiles = args.profiles or list(SQLITE_PROFILES)
+    print(f"{args.readers} readers, {args.writers} writers, {args.seconds:g}s per profile")
+    print(f"{'profile':<14}{'reads/s':>10}{'writes/s':>10}{'lock errors':>13}")
+    for name in profiles:
+        with tempfile.TemporaryDirectory(prefix='bytebank-bench-') as tmp:
+            env = dict(os.environ, SQLITE_PROFILE=name,
+                       DATABASE_URL='sqlite:///' + os.path.join(tmp, 'bench.db'))
+            child = ['--readers', str(args.readers), '--writers', str(args.writers),
+                     '--seconds', str(args.seconds), '--users', str(args.users)]
+            out = subprocess.run(
+                [sys.executable, __file__, '--child', *child],
+                env=env, capture_output=True, text=True, check=True
+            ).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        print(f"{name:<14}{result['reads']:>10.0f}{result['writes']:>10.0f}{result['errors']:>13}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""Bulk-import users (and optional initial purchases) from CSV or NDJSON.
+
+Each record has `name`, `email` and either `password` or an already computed
+`password_hash`; optional `daily_quota_mb` and `purchased_mb` (non-negative
+whole MB, otherwise the record counts as invalid). Records are
+processed in chunks: duplicate emails are dropped with one IN lookup per
+chunk, passwords are hashed in a process pool, and User, DataWallet,
+DataEntry and Transaction rows go in as multi-row INSERTs committed once per
+chunk.
+
+    python bulk_import.py subscribers.csv --chunk-size 2000 --workers 8
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+from itertools import islice
+
+from sqlalchemy import insert, select
+from werkzeug.security import generate_password_hash
+
+from app import app, db, User, DataWallet, DataEntry, Transaction
+
+
+def read_records(path, fmt):
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'ndjson':
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+def chunks(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def to_mb(value, default=0):
+    """Parse an optional MB field; None unless it is a whole number between 0
+    and MAX_AMOUNT_MB (a blank field gives `default`)."""
+    if value in (None, ''):
+        return default
+    try:
+        mb = int(str(value).strip())
+    except ValueError:
+        return None
+    return mb if 0 <= mb <= app.config['MAX_AMOUNT_MB'] else None
+
+
+def import_chunk(records, pool, seen, stats):
+    """Insert one chunk; `seen` holds every email accepted so far."""
+    fresh = []
+    for r in records:
+        email = (r.get('email') or '').strip().lower()
+        name = (r.get('name') or '').strip()
+        quota_mb = to_mb(r.get('daily_quota_mb'), 1024)
+        purchased_mb = to_mb(r.get('purchased_mb'))
+        if (not email or not name or not (r.get('password') or r.get('password_hash'))
+                or quota_mb is None or purchased_mb is None):
+            stats['invalid'] += 1
+            continue
+        if email in seen:
+            stats['duplicates'] += 1
+            continue
+        seen.add(email)
+        fresh.append((email, name, dict(r, daily_quota_mb=quota_mb, purchased_mb=purchased_mb)))
+
+    existing = set(db.session.execute(
+        select(User.email).where(User.email.in_([email for email, _, _ in fresh]))
+    ).scalars()) if fresh else set()
+    stats['duplicates'] += len(existing)
+    fresh = [row for row in fresh if row[0] not in existing]
+    if not fresh:
+        return
+
+    to_hash = [r['password'] for _, _, r in fresh if not r.get('password_hash')]
+    hash_password = partial(generate_password_hash, method=app.config['PASSWORD_HASH_METHOD'])
+    hashed = iter(pool.map(hash_password, to_hash, chunksize=max(1, len(to_hash) // 32)))
+
+    now = datetime.utcnow()
+    db.session.execute(insert(User.__table__), [
+        {'name': name, 'email': email,
+         'password_hash': r.get('password_hash') or next(hashed),
+         'daily_quota_mb': r['daily_quota_mb'],
+         'used_today_mb': 0, 'total_used_mb': 0, 'is_admin': False,
+         'created_at': now, 'session_version': 0}
+        for email, name, r in fresh
+    ])
+    ids = dict(db.session.execute(
+        select(User.email, User.id).where(User.email.in_([email for email, _, _ in fresh]))
+    ).all())
+
+    purchases = [(ids[email], r['purchased_mb']) for email, _, r in fresh]
+    db.session.execute(insert(DataWallet.__table__), [
+        {'user_id': uid, 'balance_mb': mb, 'total_purchased_mb': mb, 'total_used_mb': 0,
+         'created_at': now, 'updated_at': now}
+        for uid, mb in purchases
+    ])
+    bought = [(uid, mb) for uid, mb in purchases if mb > 0]
+    if bought:
+        db.session.execute(insert(DataEntry.__table__), [
+            {'user_id': uid, 'amount_mb': mb, 'source': 'purchased', 'added_on': now,
+             'expiry_date': now + timedelta(days=30)}
+            for uid, mb in bought
+        ])
+        db.session.execute(insert(Transaction.__table__), [
+            {'sender_id': None, 'receiver_id': uid, 'amount_mb': mb, 'timestamp': now,
+             'note': f"Bought {mb} MB of data"}
+            for uid, mb in bought
+        ])
+    db.session.commit()
+    stats['users'] += len(fresh)
+    stats['purchases'] += len(bought)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=['csv', 'ndjson'], help='default: from the file extension')
+    parser.add_argument('--chunk-size', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    fmt = args.format or ('ndjson' if args.path.endswith(('.ndjson', '.jsonl')) else 'csv')
+
+    stats = {'read': 0, 'users': 0, 'purchases': 0, 'duplicates': 0, 'invalid': 0}
+    seen = set()
+    started = time.perf_counter()
+    with app.app_context(), ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for n, chunk in enumerate(chunks(read_records(args.path, fmt), args.chunk_size), 1):
+            chunk_started = time.perf_counter()
+            import_chunk(chunk, pool, seen, stats)
+            stats['read'] += len(chunk)
+            elapsed = time.perf_counter() - chunk_started
+            print(f"chunk {n}: {len(chunk)} rows in {elapsed:.2f}s ({len(chunk) / elapsed:.0f} rows/s)")
+    elapsed = time.perf_counter() - started
+
+    rate = stats['read'] / elapsed if elapsed else 0
+    print(f"Read {stats['read']} rows in {elapsed:.2f}s ({rate:.0f} rows/s)")
+    print(f"Created {stats['users']} users, {stats['purchases']} purchases; "
+          f"skipped {stats['duplicates']} duplicates, {stats['invalid']} invalid")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""Fail if any hot query falls back to a full table scan.
+
+Builds a throwaway SQLite database from the app's models, seeds it, runs
+EXPLAIN QUERY PLAN on the statements the routes actually execute and exits
+non-zero when a plan contains a bare `SCAN <table>` step.
+
+    python check_query_plans.py
+"""
+import re
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+
+from app import (
+    app, db, User, DataEntry, DataItem, Transaction,
+    active_entries_stmt, expired_entry_ids_stmt, marketplace_stmt, recent_transactions_stmt,
+    user_transactions_stmt,
+)
+
+SEED_USERS = 200
+SEED_ENTRIES_PER_USER = 5
+SEED_TXNS = 2000
+SEED_ITEMS = 2000
+
+TABLES = {t.name for t in db.metadata.sorted_tables}
+
+
+def hot_queries(now):
+    """(name, statement) pairs for every query that sits on a hot path."""
+    return [
+        ('active entries', active_entries_stmt(7, now)),
+        ('expired entry purge batch', expired_entry_ids_stmt(now, 1000)),
+        ('user transaction history', user_transactions_stmt(7, 51)),
+        ('user transaction history, later page', user_transactions_stmt(7, 51, (now, 1000))),
+        ('admin recent transactions', recent_transactions_stmt(51)),
+        ('admin recent transactions, later page', recent_transactions_stmt(51, (now, 1000))),
+        ('marketplace text search', marketplace_stmt(25, query='fast', sort='price_asc')),
+        ('marketplace price range', marketplace_stmt(25, min_price=10, max_price=20, sort='price_asc')),
+        ('marketplace by price, later page', marketplace_stmt(25, sort='price_desc', after=(100.0, 500))),
+        ('marketplace newest, later page', marketplace_stmt(25, after=1000)),
+    ]
+
+
+def seed(conn, now):
+    conn.execute(insert(User.__table__), [
+        {'id': i, 'name': f'user{i}', 'email': f'user{i}@bench.local', 'password_hash': 'x',
+         'daily_quota_mb': 1024, 'used_today_mb': 0}
+        for i in range(1, SEED_USERS + 1)
+    ])
+    conn.execute(insert(DataEntry.__table__), [
+        {'user_id': u, 'amount_mb': 100, 'source': 'earned', 'added_on': now,
+         'expiry_date': now + timedelta(days=k - 2)}
+        for u in range(1, SEED_USERS + 1) for k in range(SEED_ENTRIES_PER_USER)
+    ])
+    conn.execute(insert(Transaction.__table__), [
+        {'sender_id': (i % SEED_USERS) + 1 if i % 3 else None,
+         'receiver_id': ((i * 7) % SEED_USERS) + 1, 'amount_mb': 10,
+         'timestamp': now - timedelta(minutes=i), 'note': 'Transfer'}
+        for i in range(SEED_TXNS)
+    ])
+    conn.execute(insert(DataItem.__table__), [
+        {'title': f'{"fast" if i % 5 == 0 else "plain"} data pack {i}', 'description': 'Unused monthly data',
+         'price': float(i % 500), 'seller_id': (i % SEED_USERS) + 1}
+        for i in range(SEED_ITEMS)
+    ])
+    conn.exec_driver_sql('ANALYZE')
+
+
+def explain(conn, stmt):
+    compiled = stmt.compile(dialect=conn.dialect)
+    params = compiled.construct_params()
+    args = tuple(params[name] for name in compiled.positiontup)
+    rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), args).all()
+    return [row[-1] for row in rows]
+
+
+def full_scans(plan):
+    """Plan steps that read a real table without an index."""
+    scans = []
+    for step in plan:
+        m = re.match(r'SCAN (?:TABLE )?"?(\w+)"?( AS \w+)?$', step)
+        if m and m.group(1) in TABLES:
+            scans.append(step)
+    return scans
+
+
+def main():
+    engine = create_engine('sqlite://')
+    db.metadata.create_all(engine)
+    now = datetime.utcnow()
+    failures = 0
+    with engine.begin() as conn:
+        seed(conn, now)
+        for name, stmt in hot_queries(now):
+            plan = explain(conn, stmt)
+            bad = full_scans(plan)
+            status = 'FAIL' if bad else 'ok'
+            print(f"[{status}] {name}")
+            for step in plan:
+                print(f"        {step}")
+            failures += bool(bad)
+    if failures:
+        print(f"{failures} hot quer{'y' if failures == 1 else 'ies'} fell back to a full table scan")
+        return 1
+    print("All hot queries use an index")
+    return 0
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        sys.exit(main())
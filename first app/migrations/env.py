@@ -51,6 +51,18 @@ def get_metadata():
     return target_db.metadata
 
 
+# SQLite FTS5 index over data_item (virtual table plus its shadow tables);
+# created by raw DDL, so it is not in the metadata and autogenerate must
+# not try to drop it
+UNMANAGED_TABLE_PREFIXES = ('data_item_fts',)
+
+
+def include_name(name, type_, parent_names):
+    if type_ == 'table':
+        return not name.startswith(UNMANAGED_TABLE_PREFIXES)
+    return True
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -65,7 +77,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True,
+        include_name=include_name
     )
 
     with context.begin_transaction():
@@ -93,6 +106,8 @@ def run_migrations_online():
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    if conf_args.get("include_name") is None:
+        conf_args["include_name"] = include_name
 
     connectable = get_engine()
 
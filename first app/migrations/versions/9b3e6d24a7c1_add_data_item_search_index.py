@@ -0,0 +1,55 @@
+"""Add FTS5 search index and price index for DataItem
+
+Revision ID: 9b3e6d24a7c1
+Revises: 5f2a9c81d4e7
+Create Date: 2026-10-16 16:02:44.905113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b3e6d24a7c1'
+down_revision = '5f2a9c81d4e7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('data_item', schema=None) as batch_op:
+        batch_op.create_index('ix_data_item_price', ['price'], unique=False)
+
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    # External-content FTS5 table plus the triggers that keep it in step (mirrors app.DATA_ITEM_FTS_DDL)
+    op.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS data_item_fts USING fts5("
+        "title, description, content='data_item', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+    )
+    op.execute(
+        "CREATE TRIGGER IF NOT EXISTS data_item_fts_ai AFTER INSERT ON data_item BEGIN "
+        "INSERT INTO data_item_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END"
+    )
+    op.execute(
+        "CREATE TRIGGER IF NOT EXISTS data_item_fts_ad AFTER DELETE ON data_item BEGIN "
+        "INSERT INTO data_item_fts(data_item_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); END"
+    )
+    op.execute(
+        "CREATE TRIGGER IF NOT EXISTS data_item_fts_au AFTER UPDATE OF title, description ON data_item BEGIN "
+        "INSERT INTO data_item_fts(data_item_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); "
+        "INSERT INTO data_item_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END"
+    )
+    # Index the listings that already exist
+    op.execute("INSERT INTO data_item_fts(data_item_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS data_item_fts_au")
+        op.execute("DROP TRIGGER IF EXISTS data_item_fts_ad")
+        op.execute("DROP TRIGGER IF EXISTS data_item_fts_ai")
+        op.execute("DROP TABLE IF EXISTS data_item_fts")
+
+    with op.batch_alter_table('data_item', schema=None) as batch_op:
+        batch_op.drop_index('ix_data_item_price')
@@ -0,0 +1,36 @@
+"""Bump counterparties' data_version when a user's email changes
+
+Revision ID: f1b6d8e2a4c7
+Revises: d3a7b1e9c2f4
+Create Date: 2026-10-18 10:24:51.602318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1b6d8e2a4c7'
+down_revision = 'd3a7b1e9c2f4'
+branch_labels = None
+depends_on = None
+
+# mirrors app.DATA_VERSION_DDL['user']
+TRIGGER = 'user_counterparty_data_version_au'
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute(
+        f"CREATE TRIGGER IF NOT EXISTS {TRIGGER} AFTER UPDATE OF email ON user "
+        "WHEN old.email IS NOT new.email BEGIN "
+        "UPDATE user SET data_version = data_version + 1 WHERE id IN ("
+        'SELECT receiver_id FROM "transaction" WHERE sender_id = new.id '
+        'UNION SELECT sender_id FROM "transaction" WHERE receiver_id = new.id); END'
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute(f"DROP TRIGGER IF EXISTS {TRIGGER}")
@@ -0,0 +1,70 @@
+"""Report drift between wallet balances and data lots.
+
+A wallet's true balance is the sum of its user's active DataEntry lots.
+Full runs check every user; --incremental only re-checks users whose wallet
+or lots changed since the previous run, whose start time is kept in the
+instance folder.
+
+Report only: transfers move balance between wallets without moving lots, so
+setting a drifted balance to its lot total would undo them.
+
+    python reconcile.py                  # full report
+    python reconcile.py --incremental    # only users touched since last run
+"""
+import argparse
+import os
+import time
+from datetime import datetime
+
+from app import app, reconcile_wallets
+
+STATE_FILE = 'reconcile.last_run'
+
+
+def load_last_run(path):
+    try:
+        with open(path) as f:
+            return datetime.fromisoformat(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--incremental', action='store_true')
+    parser.add_argument('--show', type=int, default=20, help='drifted users to list')
+    args = parser.parse_args()
+
+    state_path = os.path.join(app.instance_path, STATE_FILE)
+    since = load_last_run(state_path) if args.incremental else None
+    if args.incremental and since is None:
+        print("No previous run recorded; checking everyone")
+    run_started = datetime.utcnow()
+
+    checked = drifted = drift_mb = 0
+    shown = 0
+    started = time.perf_counter()
+    with app.app_context():
+        for batch in reconcile_wallets(args.batch_size, since=since, now=run_started):
+            checked += batch['checked']
+            drifted += batch['drifted']
+            drift_mb += batch['drift_mb']
+            for r in batch['rows']:
+                if shown < args.show:
+                    wallet = 'no wallet' if r.wallet_id is None else f"wallet {r.balance_mb} MB"
+                    print(f"  user {r.id}: {wallet}, lots {r.lots_mb} MB")
+                    shown += 1
+    elapsed = time.perf_counter() - started
+
+    rate = checked / elapsed if elapsed else 0
+    print(f"Checked {checked} users in {elapsed:.2f}s ({rate:.0f} users/s)")
+    print(f"Drifted: {drifted} users, net {drift_mb:+d} MB")
+
+    os.makedirs(app.instance_path, exist_ok=True)
+    with open(state_path, 'w') as f:
+        f.write(run_started.isoformat())
+
+
+if __name__ == '__main__':
+    main()
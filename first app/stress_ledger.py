@@ -0,0 +1,142 @@
+"""Multi-threaded stress test for the wallet ledger.
+
+Runs concurrent transfers and wallet debits against a scratch SQLite database
+and then proves the invariants the conditional UPDATEs are meant to keep:
+
+  * no wallet is ever negative (no overdraft)
+  * total balance == initial total - MB used (no lost or duplicated update)
+  * every wallet matches initial + received - sent - used
+  * exactly one Transaction row per successful transfer
+
+    python stress_ledger.py --threads 8 --ops 500 --users 20
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--threads', type=int, default=8)
+parser.add_argument('--ops', type=int, default=500, help='operations per thread')
+parser.add_argument('--users', type=int, default=20)
+parser.add_argument('--balance', type=int, default=1000, help='starting MB per wallet')
+parser.add_argument('--max-amount', type=int, default=300)
+args = parser.parse_args()
+
+# Point the app at a scratch database before it is imported
+scratch = tempfile.NamedTemporaryFile(prefix='bytebank-stress-', suffix='.db', delete=False)
+scratch.close()
+os.environ['DATABASE_URL'] = 'sqlite:///' + scratch.name
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import OperationalError
+
+from app import app, db, User, DataWallet, Transaction, ledger_debit, ledger_transfer, record_usage
+
+app.config['EXPIRY_SCHEDULER_ENABLED'] = False
+
+
+def setup():
+    with app.app_context():
+        db.create_all()
+        db.session.execute(insert(User.__table__), [
+            {'id': i, 'name': f'stress{i}', 'email': f'stress{i}@stress.local', 'password_hash': 'x'}
+            for i in range(1, args.users + 1)
+        ])
+        db.session.execute(insert(DataWallet.__table__), [
+            {'user_id': i, 'balance_mb': args.balance, 'total_purchased_mb': 0, 'total_used_mb': 0}
+            for i in range(1, args.users + 1)
+        ])
+        db.session.commit()
+
+
+def worker(seed, stats, lock):
+    rng = random.Random(seed)
+    local = Counter()
+    moved = Counter()  # per-user net change from this thread's successful ops
+    with app.app_context():
+        for _ in range(args.ops):
+            sender = rng.randint(1, args.users)
+            amount = rng.randint(1, args.max_amount)
+            try:
+                if rng.random() < 0.8:
+                    receiver = rng.randint(1, args.users)
+                    if ledger_transfer(sender, receiver, amount, note='Stress'):
+                        local['transfers'] += 1
+                        moved[sender] -= amount
+                        moved[receiver] += amount
+                    else:
+                        local['rejected'] += 1
+                else:
+                    if ledger_debit(sender, amount, count_as_used=True):
+                        record_usage(sender, amount)
+                        db.session.commit()
+                        local['debits'] += 1
+                        local['used_mb'] += amount
+                        moved[sender] -= amount
+                    else:
+                        db.session.rollback()
+                        local['rejected'] += 1
+            except OperationalError:
+                db.session.rollback()
+                local['lock_errors'] += 1
+        db.session.remove()
+    with lock:
+        stats.update(local)
+        for uid, delta in moved.items():
+            stats[('net', uid)] += delta
+
+
+def verify(stats):
+    failures = []
+    with app.app_context():
+        balances = dict(db.session.execute(select(DataWallet.user_id, DataWallet.balance_mb)).all())
+        txn_count = db.session.execute(
+            select(func.count()).select_from(Transaction).where(Transaction.note == 'Stress')
+        ).scalar()
+    negative = {uid: bal for uid, bal in balances.items() if bal < 0}
+    if negative:
+        failures.append(f"overdrawn wallets: {negative}")
+    expected_total = args.users * args.balance - stats['used_mb']
+    if sum(balances.values()) != expected_total:
+        failures.append(f"total balance {sum(balances.values())} != expected {expected_total}")
+    for uid, bal in balances.items():
+        expected = args.balance + stats[('net', uid)]
+        if bal != expected:
+            failures.append(f"user {uid}: balance {bal} != expected {expected}")
+    if txn_count != stats['transfers']:
+        failures.append(f"{txn_count} Transaction rows for {stats['transfers']} transfers")
+    return failures
+
+
+def main():
+    setup()
+    stats, lock = Counter(), threading.Lock()
+    threads = [threading.Thread(target=worker, args=(seed, stats, lock)) for seed in range(args.threads)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    total_ops = args.threads * args.ops
+    print(f"{total_ops} ops on {args.threads} threads in {elapsed:.2f}s: {total_ops / elapsed:.0f} ops/s")
+    print(f"  transfers={stats['transfers']} debits={stats['debits']} "
+          f"rejected={stats['rejected']} lock_errors={stats['lock_errors']}")
+
+    failures = verify(stats)
+    for f in failures:
+        print(f"FAIL {f}")
+    if not failures:
+        print("OK: no lost updates, no overdrafts")
+    os.unlink(scratch.name)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())